@@ -3,7 +3,9 @@ import mysql.connector
 import os
 from dotenv import load_dotenv
 import chardet
-import re
+from classes.amenities_engine import update_missing_amenities
+from classes.export_cache import bump_export_versions
+from migrations import require_schema
 load_dotenv()
 
 # Detect CSV encoding
@@ -29,17 +31,8 @@ cursor.execute("CREATE DATABASE IF NOT EXISTS audit")
 cursor.execute("USE audit")
 
 
-create_table_query = f'''
-CREATE TABLE IF NOT EXISTS competition_amenities (
-    `Index` INT PRIMARY KEY,
-    `99acres` TEXT,
-    `C1` TEXT,
-    `C2` TEXT,
-    `C3` TEXT
-
-)
-'''
-cursor.execute(create_table_query)
+# competition_amenities is created by migrations.py
+require_schema(conn)
 
 
 # 3. Insert data into table
@@ -54,54 +47,10 @@ conn.commit()
 
 
 
-# Step 3: Functions to process amenities
-def extract_amenities_99acres(amenities_str):
-    if pd.isna(amenities_str):
-        return []
-    items = re.split(r',\s*', amenities_str)
-    # Normalize: remove numbers, strip spaces, and convert to lowercase
-    return list(set([re.sub(r'^\d+:\s*', '', item).strip().lower() for item in items]))
-
-def extract_amenities_other(text):
-    if pd.isna(text):
-        return []
-    items = re.split(r',|;|/|&', text)
-    # Normalize: strip spaces and convert to lowercase
-    return list(set([item.strip().lower() for item in items if item.strip()]))
-
-# Step 4: Process columns
-df['99acres_clean'] = df['99acres'].apply(extract_amenities_99acres)
-df['C1_clean'] = df['C1'].apply(extract_amenities_other)
-df['C2_clean'] = df['C2'].apply(extract_amenities_other)
-df['C3_clean'] = df['C3'].apply(extract_amenities_other)
-
-df['combined_C'] = df.apply(lambda row: list(set(row['C1_clean'] + row['C2_clean'] + row['C3_clean'])), axis=1)
-df['missing_amenities'] = df.apply(
-    lambda row: sorted(set(map(str.lower, row['99acres_clean'])) - set(map(str.lower, row['combined_C']))),
-    axis=1
-)
-
-# Step 5: Update MySQL table with new column values
-# Ensure the column exists (add if not)
-cursor.execute(f"""
-    ALTER TABLE competition_amenities
-    ADD COLUMN IF NOT EXISTS missing_amenities TEXT
-""")
-conn.commit()
-
-# Update each row's missing amenities
-for idx, row in df.iterrows():
-    cell_value = ', '.join(row['missing_amenities'])
-    update_query = f"""
-        UPDATE competition_amenities
-        SET missing_amenities = %s
-        WHERE `Index` = %s
-    """
-    cursor.execute(update_query, (cell_value, row["Index"]))
-
-
-conn.commit()
+# Step 4: Diff amenities against the canonical vocabulary and update all rows in one statement
+updated = update_missing_amenities(conn, df)
+bump_export_versions(conn, ["competition_amenities"])
 
 cursor.close()
 conn.close()
-print(f'Table created and data inserted, total rows: {len(df)} successfully.')
+print(f'Table created and data inserted, total rows: {len(df)} successfully ({updated} missing_amenities updated).')
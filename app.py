@@ -1,9 +1,7 @@
-from flask import Flask, render_template, request, redirect, send_file, session
+from flask import Flask, render_template, request, redirect, send_file, session, jsonify, Response, stream_with_context
 import pandas as pd
 import os, sys, json
 from dotenv import load_dotenv
-from io import BytesIO
-import mysql
 # Load environment
 load_dotenv()
 
@@ -12,12 +10,53 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from classes.mysql_handler import MySQLHandler
 from classes.gemini_models import GeminiClient
 from classes.rera_classes import RERAClasses
-from tableinsertdata import update_matching_score
-from competition_operations import run_competition_operations
+from classes import db_pool
+from classes.db_pool import request_connection
+from jobs import job_manager
+from exports import EXPORT_FORMATS, EXPORT_TABLES, export_query, build_export
+from classes.export_cache import export_key, export_versions, get_export_cache
+from classes.run_registry import create_run, get_run
+from migrations import require_schema
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
 app.secret_key = 'your_secret_key'  # Add a secret key for session management
+app.config['UPLOAD_CHUNK_ROWS'] = int(os.getenv("UPLOAD_CHUNK_ROWS", "5000"))  # 0 reads the whole CSV at once
+db_pool.init_app(app)  # Return per-request pooled connections on teardown
+
+# Upload type -> (RERAClasses method, target description)
+UPLOADERS = {
+    "rera": ("insert_rera_data", "rera table"),
+    "brouchure": ("insert_brochure_data", "brochure data table"),
+    "99acres": ("ninetynineacres_data", "99acres data table"),
+    "housing": ("insert_housing_data", "housing table"),
+    "magicbrics": ("insert_magicbrics_data", "magicbrics table"),
+    "squareyards": ("insert_squareyards_data", "squareyards table"),
+    "magicbrics-floor": ("insert_mb_floor_data", "magicbricks floor data table"),
+    "housing-floor": ("insert_housing_floor_data", "housing data table"),
+    "squareyards-floor": ("insert_squareyards_floor_data", "squareyards data table"),
+}
+
+FAST_LOAD_TYPES = {"magicbrics-floor", "housing-floor", "squareyards-floor"}
+
+def describe_load_stats(stats):
+    text = f"Loaded via {stats['method']} in {stats['seconds']}s ({stats['rows_per_sec']} rows/s)."
+    if stats['fallback_reason']:
+        text += f" LOAD DATA LOCAL INFILE was not allowed ({stats['fallback_reason']}), used batched inserts instead."
+    # Compared with the last upload into the same table that used the other method
+    baseline, rate = stats['baseline_rows_per_sec'], stats['rows_per_sec']
+    if baseline and rate:
+        text += (f" Last {stats['baseline_method']} load into {stats['table']}: {baseline} rows/s, "
+                 f"this upload ran at {rate / baseline:.1f}x that rate.")
+    else:
+        text += f" No {stats['baseline_method']} load into {stats['table']} measured yet to compare against."
+    return text
+
+def describe_failures(failures):
+    # Failed chunks were rolled back as a whole, none of their rows were written
+    rows = sum(f.row_count for f in failures)
+    details = "; ".join(f"chunk {f.batch_no}: {f.error}" for f in failures)
+    return f"❌ {len(failures)} chunk(s) failed and were not written ({rows} rows): {details}"
 
 @app.route('/csv')
 def csv():
@@ -30,45 +69,36 @@ def upload():
 
     if not file or not file.filename.endswith('.csv'):
         return "Invalid file"
+    if upload_type not in UPLOADERS:
+        return "❌ Invalid upload type."
 
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     file.save(filepath)
 
-    df = pd.read_csv(filepath)
-    db = MySQLHandler()
+    db = MySQLHandler(connection=request_connection())
     uploader = RERAClasses(db)
 
+    method_name, label = UPLOADERS[upload_type]
+    kwargs = {}
+    if upload_type in FAST_LOAD_TYPES:
+        # Opt-in LOAD DATA LOCAL INFILE path, falls back to batched inserts
+        kwargs['fast'] = request.form.get('fast_load') == 'on'
     try:
-        if upload_type == "rera":
-            inserted = uploader.insert_rera_data(df)
-            return f"Inserted {inserted} new rows into rera table."
-        elif upload_type == "brouchure":
-            inserted = uploader.insert_brochure_data(df)
-            return f"Inserted {inserted} new rows into brochure data table."
-        elif upload_type == "99acres":
-            inserted = uploader.ninetynineacres_data(df)
-            return f"Inserted {inserted} new rows into 99acres data table."
-        elif upload_type == "housing":
-            inserted = uploader.insert_housing_data(df)
-            return f"Inserted {inserted} new rows into housing table."
-        elif upload_type == "magicbrics":
-            inserted = uploader.insert_magicbrics_data(df)
-            return f"Inserted {inserted} new rows into magicbrics table."
-        elif upload_type == "squareyards":
-            inserted = uploader.insert_squareyards_data(df)
-            return f"Inserted {inserted} new rows into squareyards table."  
-        elif upload_type == "magicbrics-floor":
-            inserted = uploader.insert_mb_floor_data(df)
-            return f"Inserted {inserted} new rows into magicbricks floor data table."   
-        elif upload_type == "housing-floor":
-            inserted = uploader.insert_housing_floor_data(df)
-            return f"Inserted {inserted} new rows into housing data table."
-        elif upload_type == "squareyards-floor":
-            inserted = uploader.insert_squareyards_floor_data(df)
-            return f"Inserted {inserted} new rows into squareyards data table."
+        chunk_rows = app.config['UPLOAD_CHUNK_ROWS']
+        if chunk_rows > 0:
+            # Streaming mode: bounded chunks keep worker memory flat for large crawler exports
+            with pd.read_csv(filepath, chunksize=chunk_rows) as chunks:
+                inserted = uploader.insert_chunks(method_name, chunks, **kwargs)
         else:
-            return "❌ Invalid upload type."
+            inserted = uploader.insert_chunks(method_name, [pd.read_csv(filepath)], **kwargs)
+        message = (f"Read {uploader.last_rows_read} rows. Inserted {inserted} new rows into {label}. "
+                   f"Skipped {uploader.last_skipped} rows with missing keys.")
+        if uploader.last_failures:
+            message += " " + describe_failures(uploader.last_failures)
+        if uploader.last_load_stats:
+            message += " " + describe_load_stats(uploader.last_load_stats)
+        return message
     finally:
         db.close()
 
@@ -77,7 +107,7 @@ def  updated_score():
     
     try:
         client = GeminiClient()
-        processor = MySQLHandler(client)
+        processor = MySQLHandler(client, connection=request_connection())
         instructions_path = os.path.join(os.path.dirname(__file__), "prompt", "bible_instructions.json")
 
         with open(instructions_path, "r", encoding="utf-8") as file:
@@ -113,9 +143,6 @@ def index():
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    db = MySQLHandler()
-    fetcher = RERAClasses(db)
-
     if request.method == 'POST':
         action = request.form.get('action')
         if action == 'update_score':
@@ -127,19 +154,49 @@ def index():
                 if 'xid' not in df.columns:
                     return render_template('index.html', error="CSV must contain an 'xid' column")
                 xids = [int(x) for x in df['xid'].dropna().unique()]
-                session['xids'] = xids  # Store xids in session
-                update_matching_score(xids)
-                run_competition_operations()
-                return render_template('index.html', message="✅ Matching score updated and scoring complete!")
+                require_schema()
+                # The XID set lives in audit_run_xids, the session only keeps the run id
+                run_id = create_run(xids)
+                session.pop('xids', None)
+                session['run_id'] = run_id
+                # Matching + scoring runs in the background, the page polls /jobs/<job_id>
+                job_id = job_manager.submit(run_id, len(xids))
+                session['job_id'] = job_id
+                return render_template('index.html', job_id=job_id,
+                                       message=f"⏳ Job {job_id} submitted for {len(xids)} XIDs.")
             except Exception as e:
                 return render_template('index.html', error=f"❌ Error: {e}")
 
-    return render_template('index.html')     
+    return render_template('index.html', job_id=session.get('job_id'))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job)
+
+def export_run():
+    # Exports can reference a run or job explicitly, otherwise they use the last upload in the session.
+    # Returns (run, error); an explicit id that does not resolve is an error, never the session's run.
+    run_id = request.values.get('run_id')
+    job_id = request.values.get('job_id')
+    if not run_id and job_id:
+        run_id = job_manager.get_run_id(job_id)
+        if not run_id:
+            return None, f"Job {job_id} not found."
+    explicit = bool(run_id)
+    run_id = run_id or session.get('run_id')
+    run = get_run(run_id) if run_id else None
+    if explicit and not run:
+        return None, f"Run {run_id} not found."
+    return run, None
 
 @app.route('/populate_audit_data')
 def populate_audit_data():
-    db = MySQLHandler()
+    db = MySQLHandler(connection=request_connection())
     try:
+        require_schema(db.connection)
         db.populate_competition_oprns_audit_data()
         return "✅ Data populated in competition_oprns_audit_data."
     except Exception as e:
@@ -147,78 +204,66 @@ def populate_audit_data():
     finally:
         db.close()
 
-@app.route('/get_output_csv', methods=['POST'])
-def get_output_csv():
-    import mysql.connector
-    import pandas as pd
-    import os
-    from dotenv import load_dotenv
-    from io import BytesIO
-    load_dotenv()
+def cacheable(response, etag):
+    # Browsers revalidate every time and get a 304 while the export is unchanged
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def stream_export(kind, error_label):
+    # Repeats of the same export are served from the disk cache (or answered with 304);
+    # otherwise rows go from an unbuffered cursor into the response (CSV) or a file (XLSX, Parquet)
     try:
-        xids = session.get('xids', None)
-        if not xids:
+        fmt = request.values.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return render_template('index.html', error=f"❌ Unknown export format: {fmt}")
+        require_schema(request_connection())
+        run, error = export_run()
+        if error:
+            return render_template('index.html', error=f"❌ {error}")
+        if not run or not run['xid_count']:
             return render_template('index.html', error="No XIDs found for export. Please upload a file first.")
-        conn = mysql.connector.connect(
-            host=os.getenv("MYSQL_HOST"),
-            user=os.getenv("MYSQL_USER"),
-            password=os.getenv("MYSQL_PASSWORD"),
-            database=os.getenv("MYSQL_DATABASE"),
-            connection_timeout=5,
-            use_pure=True
-        )
-        placeholders = ','.join(['%s'] * len(xids))
-        # Exclude amenities_list from main output
-        query = f"SELECT * FROM competition_oprns_audit_data WHERE index_value IN ({placeholders}) AND data_point_name != 'amenities_list'"
-        df = pd.read_sql(query, conn, params=tuple(xids))
-        output = BytesIO()
-        df.to_csv(output, index=False)
-        output.seek(0)
-        conn.close()
-        return send_file(
-            output,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name='output_results.csv'
-        )
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        query, params, name = export_query(kind, run['run_id'])
+        download_name = f"{name}.{extension}"
+
+        table = EXPORT_TABLES[kind]
+        key = export_key(kind, fmt, run['xid_hash'], export_versions(request_connection(), [table]))
+        etag = key[:32]
+        if request.if_none_match.contains(etag):
+            return cacheable(Response(status=304), etag)
+
+        cache = get_export_cache()
+        path = cache.get(key, extension) if cache.enabled else None
+        chunks = None
+        if path is None:
+            path, chunks = build_export(query, params, fmt, cache=cache, key=key)
+        if path is not None:
+            response = send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name)
+        else:
+            try:
+                response = Response(
+                    stream_with_context(chunks),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={download_name}'}
+                )
+                # The export's pooled connection is released even if the body is never read
+                response.call_on_close(chunks.close)
+            except Exception:
+                chunks.close()
+                raise
+        return cacheable(response, etag)
     except Exception as e:
-        return render_template('index.html', error=f"❌ Error exporting output CSV: {e}")
+        return render_template('index.html', error=f"❌ Error exporting {error_label}: {e}")
 
-@app.route('/get_amenities_csv', methods=['POST'])
+@app.route('/get_output_csv', methods=['GET', 'POST'])
+def get_output_csv():
+    return stream_export("output", "output CSV")
+
+@app.route('/get_amenities_csv', methods=['GET', 'POST'])
 def get_amenities_csv():
-    import mysql.connector
-    import pandas as pd
-    import os
-    from dotenv import load_dotenv
-    from io import BytesIO
-    load_dotenv()
-    try:
-        xids = session.get('xids', None)
-        if not xids:
-            return render_template('index.html', error="No XIDs found for export. Please upload a file first.")
-        conn = mysql.connector.connect(
-            host=os.getenv("MYSQL_HOST"),
-            user=os.getenv("MYSQL_USER"),
-            password=os.getenv("MYSQL_PASSWORD"),
-            database=os.getenv("MYSQL_DATABASE"),
-            connection_timeout=5,
-            use_pure=True
-        )
-        placeholders = ','.join(['%s'] * len(xids))
-        query = f"SELECT * FROM competition_amenities WHERE `Index` IN ({placeholders})"
-        df = pd.read_sql(query, conn, params=tuple(xids))
-        output = BytesIO()
-        df.to_csv(output, index=False)
-        output.seek(0)
-        conn.close()
-        return send_file(
-            output,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name='amenities_results.csv'
-        )
-    except Exception as e:
-        return render_template('index.html', error=f"❌ Error exporting amenities CSV: {e}")
+    return stream_export("amenities", "amenities CSV")
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,169 @@
+import re
+import numpy as np
+import pandas as pd
+from classes.batch_writer import bulk_join_update
+
+# Canonical amenity -> spellings used by the listing sites. Anything not listed here is
+# added to the vocabulary as its cleaned text the first time it is seen.
+CANONICAL_AMENITIES = {
+    "gymnasium": ["gym", "gymnasium", "fitness centre", "fitness center", "fitness studio", "health club"],
+    "swimming pool": ["swimming pool", "pool", "swimming"],
+    "kids pool": ["kids pool", "kid pool", "toddler pool", "kids swimming pool", "childrens pool"],
+    "clubhouse": ["clubhouse", "club house", "club"],
+    "children play area": ["children play area", "childrens play area", "kids play area", "play area",
+                           "kids area", "tot lot", "kids zone"],
+    "jogging track": ["jogging track", "jogging", "jogging and strolling track", "walking track", "running track"],
+    "power backup": ["power backup", "power back up", "power back-up", "dg backup", "generator backup"],
+    "lift": ["lift", "lifts", "elevator", "elevators"],
+    "security": ["security", "24x7 security", "24 x 7 security", "security personnel"],
+    "cctv": ["cctv", "cctv camera", "cctv cameras", "cctv surveillance", "video surveillance"],
+    "car parking": ["car parking", "parking", "reserved parking", "covered parking", "open parking"],
+    "visitor parking": ["visitor parking", "visitors parking", "guest parking"],
+    "landscaped garden": ["landscaped garden", "landscape garden", "garden", "gardens", "park", "green area"],
+    "intercom": ["intercom", "intercom facility"],
+    "rain water harvesting": ["rain water harvesting", "rainwater harvesting", "rwh"],
+    "indoor games": ["indoor games", "indoor games room", "indoor game", "games room", "recreation room"],
+    "multipurpose hall": ["multipurpose hall", "multi purpose hall", "multipurpose room", "banquet hall",
+                          "party hall", "community hall"],
+    "fire fighting": ["fire fighting", "fire fighting equipment", "fire fighting system", "fire safety",
+                      "fire alarm"],
+    "piped gas": ["piped gas", "gas pipeline", "reticulated gas"],
+    "water supply": ["water supply", "24x7 water supply", "24 x 7 water supply", "water storage"],
+    "maintenance staff": ["maintenance staff", "maintenance"],
+    "shopping centre": ["shopping centre", "shopping center", "shopping mall", "retail shops", "convenience store"],
+    "cafeteria": ["cafeteria", "cafe", "food court", "restaurant"],
+    "spa": ["spa", "sauna", "steam room", "jacuzzi"],
+    "yoga": ["yoga", "yoga deck", "yoga room", "meditation area", "yoga and meditation area"],
+    "tennis court": ["tennis court", "lawn tennis court", "tennis"],
+    "badminton court": ["badminton court", "badminton"],
+    "basketball court": ["basketball court", "basketball"],
+    "cricket pitch": ["cricket pitch", "box cricket", "cricket"],
+    "amphitheatre": ["amphitheatre", "amphitheater", "open air theatre"],
+    "senior citizen area": ["senior citizen area", "senior citizen sitout", "senior citizen corner"],
+    "library": ["library", "reading room"],
+    "atm": ["atm", "bank and atm"],
+    "school": ["school"],
+    "hospital": ["hospital", "medical centre", "medical center", "clinic"],
+    "sewage treatment plant": ["sewage treatment plant", "stp", "sewage treatment"],
+    "waste management": ["waste management", "waste disposal", "garbage disposal"],
+    "wifi": ["wifi", "wi-fi", "internet", "wifi connectivity"],
+}
+
+WORD_BITS = 64
+_99ACRES_SEPARATORS = re.compile(r',\s*')
+_OTHER_SEPARATORS = re.compile(r',|;|/|&')
+_LEADING_NUMBER = re.compile(r'^\d+:\s*')
+_PUNCTUATION = re.compile(r"['’.`()]")
+_SPACES = re.compile(r"\s+")
+
+
+def clean_amenity(item):
+    item = _PUNCTUATION.sub("", item.strip().lower())
+    return _SPACES.sub(" ", item).strip()
+
+
+def split_99acres(text):
+    # "1: Lift, 2: Gymnasium" -> ["Lift", "Gymnasium"]
+    return [_LEADING_NUMBER.sub('', item) for item in _99ACRES_SEPARATORS.split(text)]
+
+
+def split_other(text):
+    return _OTHER_SEPARATORS.split(text)
+
+
+class AmenityVocabulary:
+    # Canonical amenity names with a bit position each; unknown amenities get the next free bit
+    def __init__(self, synonyms=CANONICAL_AMENITIES):
+        self.names = []
+        self._ids = {}
+        self._synonyms = {}
+        for canonical, spellings in synonyms.items():
+            self.id_for(canonical)
+            for spelling in [canonical, *spellings]:
+                self._synonyms[clean_amenity(spelling)] = canonical
+
+    def __len__(self):
+        return len(self.names)
+
+    def canonical(self, item):
+        cleaned = clean_amenity(item)
+        if not cleaned:
+            return None
+        return self._synonyms.get(cleaned, cleaned)
+
+    def id_for(self, name):
+        if name not in self._ids:
+            self._ids[name] = len(self.names)
+            self.names.append(name)
+        return self._ids[name]
+
+    def ids(self, items):
+        canonical = (self.canonical(item) for item in items)
+        return frozenset(self.id_for(name) for name in canonical if name)
+
+
+class AmenitiesEngine:
+    # Encodes each project's amenities as a uint64 bitset (one word per 64 vocabulary entries)
+    # so the diff for a whole batch is ref & ~(c1 | c2 | c3)
+    def __init__(self, vocabulary=None):
+        self.vocabulary = vocabulary or AmenityVocabulary()
+
+    def parse_column(self, values, split):
+        # Amenity id sets per cell; every distinct cell text is parsed once
+        parsed = {}
+        result = []
+        for value in values:
+            if value is None or (isinstance(value, float) and value != value):
+                result.append(frozenset())
+                continue
+            text = str(value)
+            if text not in parsed:
+                parsed[text] = self.vocabulary.ids(split(text))
+            result.append(parsed[text])
+        return result
+
+    def encode(self, id_sets, words):
+        bits = np.zeros((len(id_sets), words), dtype=np.uint64)
+        rows = [row for row, ids in enumerate(id_sets) for _ in ids]
+        ids = np.fromiter((i for ids in id_sets for i in ids), dtype=np.int64, count=len(rows))
+        if len(ids):
+            flags = np.left_shift(np.uint64(1), (ids % WORD_BITS).astype(np.uint64))
+            np.bitwise_or.at(bits, (np.asarray(rows, dtype=np.int64), ids // WORD_BITS), flags)
+        return bits
+
+    def decode(self, bits):
+        # Sorted amenity names per row
+        shifts = np.arange(WORD_BITS, dtype=np.uint64)
+        flags = ((bits[:, :, None] >> shifts) & np.uint64(1)).astype(bool).reshape(len(bits), -1)
+        flags = flags[:, :len(self.vocabulary)]
+        order = np.argsort(self.vocabulary.names, kind="stable")
+        names = np.asarray(self.vocabulary.names, dtype=object)[order]
+        flags = flags[:, order]
+        return [names[row].tolist() for row in flags]
+
+    def missing_amenities(self, ref, c1, c2, c3):
+        # Columns of raw cell text; returns the sorted canonical 99acres amenities no competitor lists
+        ref_ids = self.parse_column(ref, split_99acres)
+        comp_ids = [self.parse_column(column, split_other) for column in (c1, c2, c3)]
+        words = max(1, -(-len(self.vocabulary) // WORD_BITS))
+        competitors = np.zeros((len(ref_ids), words), dtype=np.uint64)
+        for ids in comp_ids:
+            competitors |= self.encode(ids, words)
+        missing = self.encode(ref_ids, words) & ~competitors
+        return self.decode(missing)
+
+    def missing_frame(self, df):
+        # competition_amenities rows -> missing_amenities cell text, in row order
+        missing = self.missing_amenities(df['99acres'].tolist(), df['C1'].tolist(),
+                                         df['C2'].tolist(), df['C3'].tolist())
+        return pd.Series([', '.join(names) for names in missing], index=df.index)
+
+
+def update_missing_amenities(conn, df, engine=None):
+    # Writes missing_amenities for every row of df with one join UPDATE; returns rows changed
+    if df.empty:
+        return 0
+    engine = engine or AmenitiesEngine()
+    missing = engine.missing_frame(df)
+    rows = list(zip((int(i) for i in df['Index'].tolist()), missing.tolist()))
+    return bulk_join_update(conn, "competition_amenities", keys=("Index",), columns=("missing_amenities",), rows=rows)
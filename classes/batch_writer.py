@@ -0,0 +1,133 @@
+import mysql.connector
+
+# MySQL can only index TEXT/BLOB columns on a prefix (error 1170 otherwise)
+TEXT_TYPES = {"tinytext", "text", "mediumtext", "longtext", "tinyblob", "blob", "mediumblob", "longblob"}
+TEXT_PREFIX = 64
+
+_key_types = {}
+
+class BatchFailure:
+    def __init__(self, label, batch_no, row_count, error):
+        self.label = label
+        self.batch_no = batch_no
+        self.row_count = row_count
+        self.error = error
+
+    def __repr__(self):
+        return f"BatchFailure({self.label}, batch={self.batch_no}, rows={self.row_count}, error={self.error})"
+
+
+class BatchWriter:
+    # Buffers rows for one INSERT ... ON DUPLICATE KEY UPDATE statement and
+    # flushes them with executemany, committing once per batch.
+    def __init__(self, conn, query, batch_size=500, label="rows"):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.conn = conn
+        self.query = query
+        self.batch_size = batch_size
+        self.label = label
+        self.buffer = []
+        self.batches = 0
+        self.written = 0
+        self.failures = []
+
+    def add(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        rows, self.buffer = self.buffer, []
+        self.batches += 1
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany(self.query, rows)
+            self.conn.commit()
+            self.written += len(rows)
+        except mysql.connector.Error as err:
+            self.conn.rollback()
+            failure = BatchFailure(self.label, self.batches, len(rows), err)
+            self.failures.append(failure)
+            print(f"❌ {self.label} batch {self.batches} failed ({len(rows)} rows): {err}")
+        finally:
+            cursor.close()
+
+    def close(self):
+        self.flush()
+        status = "✅" if not self.failures else "⚠️"
+        print(f"{status} {self.label}: wrote {self.written} rows in {self.batches} batches, "
+              f"{len(self.failures)} failed batches")
+        return self.failures
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Drop buffered rows on error, already-flushed batches stay committed
+            self.buffer = []
+        return False
+
+
+class BatchWriteError(Exception):
+    def __init__(self, failures):
+        self.failures = failures
+        summary = "; ".join(f"{f.label} batch {f.batch_no} ({f.row_count} rows): {f.error}" for f in failures)
+        super().__init__(f"{len(failures)} batch(es) failed: {summary}")
+
+
+def staging_index_parts(cursor, table, keys):
+    # "`key`" per join key, "`key`(TEXT_PREFIX)" for TEXT/BLOB keys; column types cached per process
+    if table not in _key_types:
+        cursor.execute(
+            "SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (table,)
+        )
+        _key_types[table] = {name: data_type.lower() for name, data_type in cursor.fetchall()}
+    types = _key_types[table]
+    return [f"`{key}`({TEXT_PREFIX})" if types.get(key) in TEXT_TYPES else f"`{key}`" for key in keys]
+
+
+def bulk_join_update(conn, table, keys, columns, rows, assignments=(), chunk_size=1000):
+    # Update many rows with one statement: rows are (*keys, *columns) tuples loaded into a
+    # session temporary table, then applied with a single join UPDATE in one transaction.
+    # `assignments` are extra SET clauses applied to every matched row, e.g. "is_scored = 1".
+    if not rows:
+        return 0
+    staging = f"tmp_bulk_{table}"
+    fields = [*keys, *columns]
+    field_list = ", ".join(f"`{field}`" for field in fields)
+    join = " AND ".join(f"t.`{key}` = s.`{key}`" for key in keys)
+    sets = [f"t.`{col}` = s.`{col}`" for col in columns] + [f"t.{clause}" for clause in assignments]
+
+    cursor = conn.cursor()
+    try:
+        key_list = ", ".join(staging_index_parts(cursor, table, keys))
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS `{staging}`")
+        # Same column types as the target table, indexed on the join keys (prefix for TEXT keys)
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE `{staging}` (INDEX ({key_list})) "
+            f"SELECT {field_list} FROM `{table}` LIMIT 0"
+        )
+        insert = f"INSERT INTO `{staging}` ({field_list}) VALUES ({', '.join(['%s'] * len(fields))})"
+        for start in range(0, len(rows), chunk_size):
+            cursor.executemany(insert, rows[start:start + chunk_size])
+        cursor.execute(f"UPDATE `{table}` t JOIN `{staging}` s ON {join} SET {', '.join(sets)}")
+        updated = cursor.rowcount
+        conn.commit()
+        return updated
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS `{staging}`")
+        except mysql.connector.Error:
+            pass
+        cursor.close()
@@ -0,0 +1,125 @@
+import threading
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+# Source tables in the order of the data_points mapping rows: ref (99acres), c1, c2, c3
+SOURCE_TABLES = ["99acres_table", "magic_bricks_table", "housing_table", "square_yards_table"]
+MAPPING_META_COLUMNS = ('id', 'website', 'created_at')
+COMPOSITE_SEPARATOR = "+"
+
+
+def split_column_mapping(col):
+    # 'Project Locality + Project Region' -> ['Project_Locality', 'Project_Region']
+    if not col:
+        return []
+    if COMPOSITE_SEPARATOR not in col:
+        return [col]
+    return [part.strip().replace(" ", "_") for part in col.split(COMPOSITE_SEPARATOR) if part.strip()]
+
+
+class SourceColumn(BaseModel):
+    table: str
+    mapping: Optional[str]
+    columns: List[str]
+
+    @property
+    def is_composite(self):
+        return len(self.columns) > 1
+
+
+class DataPointMapping(BaseModel):
+    name: str
+    sources: List[SourceColumn]
+
+
+class XidMapping(BaseModel):
+    xid: int
+    data_point_name: str
+    c1: Optional[str]
+    c2: Optional[str]
+    c3: Optional[str]
+
+
+class CompiledMapping(BaseModel):
+    checksum: Optional[str]
+    # Wide layout: one column per data point, one row per source table
+    data_points: List[DataPointMapping] = []
+    # Long layout: one row per (xid, data_point_name) with c1/c2/c3 columns
+    xid_mappings: List[XidMapping] = []
+
+    def columns_for(self, table) -> List[str]:
+        columns = set()
+        for dp in self.data_points:
+            for source in dp.sources:
+                if source.table == table:
+                    columns.update(source.columns)
+        return sorted(columns)
+
+
+_cache: Dict[Optional[str], CompiledMapping] = {}
+_cache_lock = threading.Lock()
+
+
+def _row_value(row, key, position):
+    return row[key] if isinstance(row, dict) else row[position]
+
+
+def data_points_checksum(cursor) -> Optional[str]:
+    cursor.execute("CHECKSUM TABLE data_points")
+    row = cursor.fetchone()
+    if not row:
+        return None
+    checksum = _row_value(row, 'Checksum', 1)
+    return str(checksum) if checksum is not None else None
+
+
+def compile_mapping(column_names, rows, checksum=None) -> CompiledMapping:
+    records = [row if isinstance(row, dict) else dict(zip(column_names, row)) for row in rows]
+
+    if 'data_point_name' in column_names:
+        xid_mappings = [
+            XidMapping(
+                xid=r['xid'],
+                data_point_name=r['data_point_name'],
+                c1=r.get('c1'),  # housing_table
+                c2=r.get('c2'),  # magicbricks
+                c3=r.get('c3'),  # squareyards
+            )
+            for r in records
+        ]
+        return CompiledMapping(checksum=checksum, xid_mappings=xid_mappings)
+
+    # Source rows are positional (99acres, magicbricks, housing, squareyards), keep them in id order
+    if 'id' in column_names:
+        records.sort(key=lambda r: r['id'])
+    if len(records) < len(SOURCE_TABLES):
+        raise ValueError(f"data_points has {len(records)} source rows, expected {len(SOURCE_TABLES)}")
+
+    data_points = []
+    for name in column_names:
+        if name in MAPPING_META_COLUMNS:
+            continue
+        sources = [
+            SourceColumn(table=table, mapping=records[idx][name], columns=split_column_mapping(records[idx][name]))
+            for idx, table in enumerate(SOURCE_TABLES)
+        ]
+        data_points.append(DataPointMapping(name=name, sources=sources))
+    return CompiledMapping(checksum=checksum, data_points=data_points)
+
+
+def load_data_points_mapping(cursor) -> CompiledMapping:
+    # One CHECKSUM query per call; the table is only re-read and re-compiled when it changed
+    checksum = data_points_checksum(cursor)
+    with _cache_lock:
+        cached = _cache.get(checksum)
+    if cached is not None and checksum is not None:
+        return cached
+
+    cursor.execute("SELECT * FROM data_points")
+    rows = cursor.fetchall()
+    compiled = compile_mapping(list(cursor.column_names), rows, checksum)
+    with _cache_lock:
+        _cache.clear()
+        _cache[checksum] = compiled
+    print(f"✅ Compiled data_points mapping (checksum {checksum})")
+    return compiled
@@ -0,0 +1,108 @@
+import os
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+import mysql.connector
+from mysql.connector import pooling, errors
+from dotenv import load_dotenv
+
+load_dotenv()
+
+POOL_NAME = "audit_pool"
+MAX_POOL_SIZE = pooling.CNX_POOL_MAXSIZE
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool_size():
+    # Pool size is clamped to what mysql-connector allows (1..32)
+    size = int(os.getenv("MYSQL_POOL_SIZE", "5"))
+    return max(1, min(size, MAX_POOL_SIZE))
+
+
+def pool_config():
+    config = {
+        "pool_name": POOL_NAME,
+        "pool_size": pool_size(),
+        "pool_reset_session": True,
+        "host": os.getenv("MYSQL_HOST"),
+        "user": os.getenv("MYSQL_USER"),
+        "password": os.getenv("MYSQL_PASSWORD"),
+        "database": os.getenv("MYSQL_DATABASE"),
+        "connection_timeout": int(os.getenv("MYSQL_CONNECT_TIMEOUT", "5")),
+        "use_pure": True,
+        "allow_local_infile": False,
+    }
+    if os.getenv("MYSQL_ALLOW_LOCAL_INFILE", "0") == "1":
+        # The floor-plan fast path only loads files from tempfile.mkstemp; restricting LOCAL INFILE
+        # to that directory keeps a hostile server from requesting any other file the client can read
+        config["allow_local_infile_in_path"] = tempfile.gettempdir()
+    return config
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = pool_config()
+                _pool = pooling.MySQLConnectionPool(**config)
+                print(f"✅ MySQL pool '{POOL_NAME}' ready ({config['pool_size']} connections)")
+    return _pool
+
+
+def get_connection(timeout=None):
+    # Check out a connection, waiting up to MYSQL_POOL_TIMEOUT seconds when the pool is exhausted.
+    # Calling close() on the returned connection hands it back to the pool.
+    if timeout is None:
+        timeout = float(os.getenv("MYSQL_POOL_TIMEOUT", "10"))
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = get_pool().get_connection()
+            break
+        except errors.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+
+    # Health check on checkout: reconnect connections the server has dropped
+    try:
+        conn.ping(reconnect=True, attempts=2, delay=0)
+    except mysql.connector.Error:
+        conn.close()
+        raise
+    return conn
+
+
+@contextmanager
+def pooled_connection():
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def request_connection():
+    # One pooled connection per Flask request, returned in the teardown hook below
+    from flask import g
+    if 'db_conn' not in g:
+        g.db_conn = get_connection()
+    return g.db_conn
+
+
+def init_app(app):
+    @app.teardown_appcontext
+    def release_request_connection(exc):
+        from flask import g
+        conn = g.pop('db_conn', None)
+        if conn is None:
+            return
+        try:
+            if exc is not None:
+                conn.rollback()
+        finally:
+            conn.close()
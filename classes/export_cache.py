@@ -0,0 +1,134 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "export_cache")
+EXPORT_CACHE_FORMAT = 1  # Bump when the rendered file layout changes, so old entries are never served
+
+def bump_export_versions(conn, tables):
+    # Called after pipeline writes; every cached export built from these tables goes stale.
+    # export_versions is created by migrations.py.
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            "INSERT INTO export_versions (table_name, version) VALUES (%s, 1) "
+            "ON DUPLICATE KEY UPDATE version = version + 1",
+            [(table,) for table in tables]
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def export_versions(conn, tables):
+    cursor = conn.cursor()
+    try:
+        placeholders = ",".join(["%s"] * len(tables))
+        cursor.execute(
+            f"SELECT table_name, version FROM export_versions WHERE table_name IN ({placeholders})",
+            tuple(tables)
+        )
+        found = dict(cursor.fetchall())
+    finally:
+        cursor.close()
+    return {table: found.get(table, 0) for table in tables}
+
+
+def export_key(kind, fmt, xid_hash, versions):
+    # Same XID set (see run_registry.xid_set_hash), kind, format and table versions -> same file
+    payload = json.dumps([EXPORT_CACHE_FORMAT, kind, fmt, xid_hash, versions], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExportCache:
+    # Rendered export files on local disk, evicted least recently used first beyond max_bytes
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.getenv("EXPORT_CACHE_DIR", DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("EXPORT_CACHE_MAX_MB", "512")) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path_for(self, key, extension):
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def temp_path(self, extension):
+        # Written next to the cache entries so store() is an atomic rename
+        return os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}.{extension}")
+
+    def get(self, key, extension):
+        path = self.path_for(key, extension)
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def store(self, key, extension, temp_path):
+        path = self.path_for(key, extension)
+        os.replace(temp_path, path)
+        self.evict()
+        return path
+
+    def tee(self, key, extension, chunks):
+        # Yields chunks unchanged while writing them to the cache; the entry is only
+        # stored when the whole stream was produced
+        temp_path = self.temp_path(extension)
+        complete = False
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()  # Releases whatever the source holds when the stream is abandoned
+            if complete:
+                self.store(key, extension, temp_path)
+            elif os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    # Files being streamed stay readable through their open handle
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_export_cache() -> ExportCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExportCache()
+    return _cache
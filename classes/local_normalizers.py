@@ -0,0 +1,246 @@
+import os
+import re
+import sys
+import json
+
+# Deterministic versions of the operation_prompts.json rules for the text data points.
+# A normalizer returns UNHANDLED for values it cannot be sure about; those rows still go to the LLM.
+UNHANDLED = object()
+NA_OUTPUT = "N/A"
+NA_VARIANTS = frozenset(['not available', 'n/a', 'na', 'not found', 'null', 'none', ''])
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_normalizer_corpus.json")
+
+_SPACES = re.compile(r"\s+")
+_DROP_CHARS = re.compile(r"['’.`]")
+_SPECIAL_CHARS = re.compile(r"[^a-z0-9& ]")
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+_ROMAN = re.compile(r"^(xxx|xx|x)?(ix|iv|v?i{0,3})$")
+_ROMAN_VALUES = {'i': 1, 'v': 5, 'x': 10}
+
+BUILDER_STOP_PHRASES = ["builders and developers"]
+BUILDER_STOP_WORDS = frozenset([
+    "builders", "group", "developers", "realtors", "llp", "pvt", "ltd", "limited",
+    "private", "realty", "infrastructures",
+])
+# Words ending in s that are not plurals
+SINGULAR_EXCEPTIONS = frozenset(["ss", "us", "is", "os", "as"])
+
+CITY_ALIASES = {
+    "central mumbai": "mumbai",
+    "mumbai south": "mumbai",
+    "western mumbai": "mumbai",
+    "thane outskirts": "thane",
+    "beyond thane": "thane",
+    "mira road and beyond": "beyond mira road",
+}
+
+
+def is_na(value):
+    if value is None:
+        return True
+    if isinstance(value, float) and value != value:
+        return True
+    return str(value).strip().lower() in NA_VARIANTS
+
+
+def clean_text(value):
+    # lower case, '&' -> 'and', drop other special characters, collapse spaces
+    text = str(value).lower()
+    text = _DROP_CHARS.sub("", text)
+    text = text.replace("&", " and ")
+    text = _SPECIAL_CHARS.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def roman_to_int(token):
+    if not token or not _ROMAN.match(token):
+        return None
+    total = 0
+    for current, following in zip(token, token[1:] + " "):
+        value = _ROMAN_VALUES[current]
+        total += -value if following != " " and _ROMAN_VALUES[following] > value else value
+    return total
+
+
+def singularize(word):
+    if len(word) <= 3 or word[-2:] in SINGULAR_EXCEPTIONS or not word.endswith("s"):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "zes", "ches", "shes")):
+        return word[:-2]
+    return word[:-1]
+
+
+def normalize_project_name(value):
+    if is_na(value):
+        return NA_OUTPUT
+    if _NON_ASCII.search(str(value)):
+        return UNHANDLED
+    words = []
+    for word in clean_text(value).split(" "):
+        number = roman_to_int(word)
+        words.append(str(number) if number else word)
+    return " ".join(words) or NA_OUTPUT
+
+
+def normalize_builder_name(value):
+    if is_na(value):
+        return NA_OUTPUT
+    if _NON_ASCII.search(str(value)):
+        return UNHANDLED
+    text = clean_text(value)
+    for phrase in BUILDER_STOP_PHRASES:
+        text = text.replace(phrase, " ")
+    words = [singularize(w) for w in text.split() if w not in BUILDER_STOP_WORDS]
+    return " ".join(words) or NA_OUTPUT
+
+
+def normalize_city(city):
+    return CITY_ALIASES.get(city, city)
+
+
+def normalize_project_address(ref, comparables):
+    # The comparable output depends on the ref locality/city, so this works on a whole row
+    if is_na(ref):
+        ref_out = NA_OUTPUT
+        locality = city = None
+    else:
+        if _NON_ASCII.search(str(ref)) or "," not in str(ref):
+            return UNHANDLED
+        parts = [clean_text(p) for p in str(ref).split(",")]
+        parts = [p for p in parts if p]
+        if len(parts) < 2:
+            return UNHANDLED
+        locality, city = parts[0], normalize_city(parts[-1])
+        ref_out = f"{locality} {city}"
+
+    outputs = [ref_out]
+    for comp in comparables:
+        if is_na(comp):
+            outputs.append(NA_OUTPUT)
+            continue
+        if _NON_ASCII.search(str(comp)):
+            return UNHANDLED
+        comp_text = " ".join(normalize_city(p) for p in (clean_text(p) for p in str(comp).split(",")) if p)
+        padded = f" {comp_text} "
+        if locality and city and f" {locality} " in padded and f" {city} " in padded:
+            outputs.append(f"{locality} {city}")
+        else:
+            outputs.append(comp_text or NA_OUTPUT)
+    return outputs
+
+
+def _per_value(normalizer):
+    def normalize_row(ref, comparables):
+        outputs = [normalizer(v) for v in [ref, *comparables]]
+        return UNHANDLED if any(o is UNHANDLED for o in outputs) else outputs
+    return normalize_row
+
+
+LOCAL_NORMALIZERS = {
+    "project_name": _per_value(normalize_project_name),
+    "builder_name": _per_value(normalize_builder_name),
+    "project_address": normalize_project_address,
+}
+
+
+def local_normalization_enabled():
+    return os.getenv("LOCAL_NORMALIZATION", "1") == "1"
+
+
+def has_local_normalizer(data_point):
+    return local_normalization_enabled() and data_point in LOCAL_NORMALIZERS
+
+
+def normalize_rows_locally(data_point, rows):
+    # Returns (normalized dicts for rows the rules handled, rows left for the LLM)
+    normalize_row = LOCAL_NORMALIZERS[data_point]
+    handled, unhandled = [], []
+    for row in rows:
+        outputs = normalize_row(row['value_99acres'], [row['c1'], row['c2'], row['c3']])
+        if outputs is UNHANDLED:
+            unhandled.append(row)
+            continue
+        handled.append({
+            "data_point_name": data_point,
+            "index": row['index_value'],
+            "ref_normalised": outputs[0],
+            "c1_normalised": outputs[1],
+            "c2_normalised": outputs[2],
+            "c3_normalised": outputs[3],
+        })
+    return handled, unhandled
+
+
+def comparable_form(value):
+    # Agreement is judged the way ScoreCalculator compares values
+    if is_na(value):
+        return None
+    return re.sub(r'[^\w.]', '', str(value).strip().lower()) or None
+
+
+def check_corpus(path=CORPUS_PATH):
+    # Each corpus case: {"data_point", "ref", "comparables", "expected": [ref, c1, c2, c3]}
+    with open(path, "r", encoding="utf-8") as f:
+        cases = json.load(f)
+    failures = []
+    for case in cases:
+        outputs = LOCAL_NORMALIZERS[case["data_point"]](case["ref"], case["comparables"])
+        expected = case["expected"]
+        if outputs is UNHANDLED and expected is None:
+            continue
+        if outputs is UNHANDLED or expected is None or \
+                [comparable_form(o) for o in outputs] != [comparable_form(e) for e in expected]:
+            failures.append({**case, "local": None if outputs is UNHANDLED else outputs})
+    return len(cases), failures
+
+
+def check_llm_agreement(cursor, data_point, limit=1000):
+    # Compare the rules with LLM outputs already stored in competition_oprns_audit_data
+    cursor.execute(
+        """
+        SELECT index_value, value_99acres, c1, c2, c3,
+               ref_normalised, c1_normalised, c2_normalised, c3_normalised
+        FROM competition_oprns_audit_data
+        WHERE data_point_name = %s AND is_scored = 1
+        LIMIT %s
+        """,
+        (data_point, limit)
+    )
+    compared = agreed = unhandled = 0
+    disagreements = []
+    for row in cursor.fetchall():
+        outputs = LOCAL_NORMALIZERS[data_point](row['value_99acres'], [row['c1'], row['c2'], row['c3']])
+        if outputs is UNHANDLED:
+            unhandled += 1
+            continue
+        llm = [row['ref_normalised'], row['c1_normalised'], row['c2_normalised'], row['c3_normalised']]
+        compared += 1
+        if [comparable_form(o) for o in outputs] == [comparable_form(v) for v in llm]:
+            agreed += 1
+        elif len(disagreements) < 20:
+            disagreements.append({"index": row['index_value'], "local": outputs, "llm": llm})
+    return {"compared": compared, "agreed": agreed, "unhandled": unhandled, "disagreements": disagreements}
+
+
+if __name__ == "__main__":
+    # python -m classes.local_normalizers [--db]
+    total, failures = check_corpus()
+    print(f"Corpus: {total - len(failures)}/{total} cases agree")
+    for failure in failures:
+        print(f"  ❌ {failure}")
+
+    if "--db" in sys.argv:
+        from classes.db_pool import pooled_connection
+        with pooled_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            for dp in LOCAL_NORMALIZERS:
+                report = check_llm_agreement(cursor, dp)
+                print(f"{dp}: {report['agreed']}/{report['compared']} agree with stored LLM output, "
+                      f"{report['unhandled']} left to the LLM")
+                for d in report["disagreements"]:
+                    print(f"  ≠ {d}")
+            cursor.close()
+
+    sys.exit(1 if failures else 0)
@@ -1,10 +1,13 @@
 import mysql.connector
 from pydantic import BaseModel
 from typing import Union, List 
-from dotenv import load_dotenv
-import os, json
+import json
 import pandas as pd
 from classes.gemini_models import GeminiClient
+from classes.data_point_mapping import load_data_points_mapping
+from classes.db_pool import get_connection
+from classes.batch_writer import bulk_join_update
+from classes.export_cache import bump_export_versions
 
 
 class DataPointScore(BaseModel):
@@ -13,22 +16,19 @@ class DataPointScore(BaseModel):
     score: int
 
 class MySQLHandler:
-    def __init__(self):
-        #self.client = gemini_client 
-        load_dotenv()  # Load variables from .env
-        self.config = {
-            "host": os.getenv("MYSQL_HOST"),
-            "user": os.getenv("MYSQL_USER"),
-            "password": os.getenv("MYSQL_PASSWORD"),
-            "database": os.getenv("MYSQL_DATABASE"),
-        }
-        self.connection = None
+    def __init__(self, gemini_client=None, connection=None):
+        self.client = gemini_client
+        # A connection passed in (e.g. the per-request one) is owned by the caller;
+        # otherwise one is checked out of the shared pool and returned on close()
+        self.connection = connection
+        self._owns_connection = connection is None
         self.cursor = None
         self.connect()
 
     def connect(self):
         try:
-            self.connection = mysql.connector.connect(**self.config)
+            if self.connection is None:
+                self.connection = get_connection()
             self.cursor = self.connection.cursor(dictionary=True)
             print("✅ Connected to MySQL")
         except mysql.connector.Error as err:
@@ -56,6 +56,46 @@ class MySQLHandler:
         except mysql.connector.Error as err:
             print(f"❌ INSERT Error: {err}")
 
+    def insert_many(self, query, rows, chunk_size=1000):
+        # Chunked executemany inside a single transaction; returns the number of rows written.
+        # On error the transaction is rolled back and the error re-raised so callers can report it.
+        if not self.connection or not self.cursor:
+            print("❌ No database connection.")
+            return 0
+        if not rows:
+            return 0
+        try:
+            for start in range(0, len(rows), chunk_size):
+                self.cursor.executemany(query, rows[start:start + chunk_size])
+            self.connection.commit()
+            print(f"✅ Data Inserted ({len(rows)} rows)")
+            return len(rows)
+        except mysql.connector.Error as err:
+            self.connection.rollback()
+            print(f"❌ INSERT Error ({len(rows)} rows rolled back): {err}")
+            raise
+
+    def load_data_local_infile(self, path, table, columns):
+        # Bulk load a cleaned CSV written by RERAClasses; errors are raised so callers can fall back
+        path = path.replace("\\", "/")  # MySQL string literal, forward slashes work on Windows too
+        query = f"""
+            LOAD DATA LOCAL INFILE '{path}'
+            INTO TABLE `{table}`
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+            LINES TERMINATED BY '\\n'
+            ({', '.join(f'`{col}`' for col in columns)})
+        """
+        try:
+            self.cursor.execute(query)
+            loaded = self.cursor.rowcount
+            self.connection.commit()
+            print(f"✅ Data Loaded ({loaded} rows)")
+            return loaded
+        except mysql.connector.Error:
+            self.connection.rollback()
+            raise
+
     def update(self, query, params):
         try:
             self.cursor.execute(query, params)
@@ -76,23 +116,14 @@ class MySQLHandler:
 
     def update_scores(self, results: List[DataPointScore]):
         print(f"Updating scores for {len(results)} results")
-        for r in results:
-            update_query = """
-                UPDATE bible_data
-                SET score = %s,  is_scored = 1, updated_at = NOW()
-                WHERE index_value = %s AND data_point_name = %s
-            """
-            self.cursor.execute(update_query, (
-                r.score,
-                r.index,
-                r.data_point_name
-            ))
-            if self.cursor.rowcount == 0:
-                print(f"❌ No row updated for index: {r.index}, data_point: {r.data_point_name}")
-            else:
-                print(f"✅ Updated index: {r.index}, data_point: {r.data_point_name}")
-            self.conn.commit()
-            
+        updated = bulk_join_update(
+            self.connection, "bible_data",
+            keys=("index_value", "data_point_name"),
+            columns=("score",),
+            rows=[(r.index, r.data_point_name, r.score) for r in results],
+            assignments=("is_scored = 1", "updated_at = NOW()")
+        )
+        print(f"✅ Updated {updated} of {len(results)} rows")
 
     def process_data_point(self, data_point, instruction):
         rows = self.fetch_unscored_rows(data_point)
@@ -106,14 +137,14 @@ class MySQLHandler:
         self.update_scores(results)
 
     def populate_competition_oprns_audit_data(self):
-        # Fetch all mappings from data_points
-        mappings = self.select("SELECT * FROM data_points")
-        for row in mappings:
-            xid = row['xid']
-            dp_name = row['data_point_name']
-            col1 = row['c1']  # housing_table
-            col2 = row['c2']  # magicbricks
-            col3 = row['c3']  # squareyards
+        # Fetch all mappings from data_points (compiled and cached per table checksum)
+        mapping = load_data_points_mapping(self.cursor)
+        for row in mapping.xid_mappings:
+            xid = row.xid
+            dp_name = row.data_point_name
+            col1 = row.c1  # housing_table
+            col2 = row.c2  # magicbricks
+            col3 = row.c3  # squareyards
 
             def fetch_value(table, col, xid):
                 if not col or col.strip() == '':
@@ -136,12 +167,15 @@ class MySQLHandler:
                     value_squareyards=VALUES(value_squareyards)
             """
             self.insert(insert_query, (xid, dp_name, v1, v2, v3))
+        bump_export_versions(self.connection, ["competition_oprns_audit_data"])
 
     def close(self):
         if self.cursor:
             self.cursor.close()
-        if self.connection:
+            self.cursor = None
+        if self.connection and self._owns_connection:
             self.connection.close()
+            self.connection = None
         print(" Connection Closed")
 
 
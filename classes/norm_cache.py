@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "norm_cache.sqlite3")
+NORMALISED_FIELDS = ("ref_normalised", "c1_normalised", "c2_normalised", "c3_normalised")
+SQLITE_BATCH = 500  # Stay below SQLite's bound-parameter limit
+
+
+def instruction_hash(instruction: str) -> str:
+    # Changing a rule in operation_prompts.json changes the hash, so stale entries are never hit
+    return hashlib.sha256(instruction.encode("utf-8")).hexdigest()[:16]
+
+
+def _raw(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value != value:  # NaN
+        return None
+    return str(value)
+
+
+class NormalizationCache:
+    # Persistent (SQLite) cache of LLM normalizations keyed by data point, instruction
+    # hash and raw ref/c1/c2/c3 values, with TTL expiry and LRU eviction.
+    def __init__(self, path=None, max_entries=None, ttl_seconds=None):
+        self.path = path or os.getenv("NORM_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.max_entries = max_entries or int(os.getenv("NORM_CACHE_MAX_ENTRIES", "200000"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("NORM_CACHE_TTL_DAYS", "30")) * 86400
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS norm_cache (
+                cache_key TEXT PRIMARY KEY,
+                data_point TEXT NOT NULL,
+                normalised TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_norm_cache_last_used ON norm_cache (last_used)")
+        self._conn.commit()
+
+    def make_key(self, data_point, instruction, ref, c1, c2, c3) -> str:
+        payload = json.dumps([data_point, instruction_hash(instruction), _raw(ref), _raw(c1), _raw(c2), _raw(c3)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys) -> dict:
+        # Returns {cache_key: {ref_normalised, c1_normalised, ...}} for fresh entries only
+        found = {}
+        now = time.time()
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), SQLITE_BATCH):
+                batch = unique_keys[start:start + SQLITE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT cache_key, normalised FROM norm_cache WHERE cache_key IN ({placeholders}) AND created_at >= ?",
+                    (*batch, now - self.ttl_seconds)
+                ).fetchall()
+                for cache_key, normalised in rows:
+                    found[cache_key] = json.loads(normalised)
+            if found:
+                self._conn.executemany(
+                    "UPDATE norm_cache SET last_used = ? WHERE cache_key = ?",
+                    [(now, cache_key) for cache_key in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, entries):
+        # entries: iterable of (cache_key, data_point, {ref_normalised, c1_normalised, ...})
+        now = time.time()
+        rows = [
+            (cache_key, data_point, json.dumps({field: values.get(field) for field in NORMALISED_FIELDS}), now, now)
+            for cache_key, data_point, values in entries
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO norm_cache (cache_key, data_point, normalised, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM norm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM norm_cache").fetchone()
+            if count > self.max_entries:
+                # Least recently used entries go first
+                self._conn.execute(
+                    "DELETE FROM norm_cache WHERE cache_key IN "
+                    "(SELECT cache_key FROM norm_cache ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_norm_cache() -> NormalizationCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = NormalizationCache()
+    return _cache
@@ -1,286 +1,255 @@
 import pandas as pd
 import json
+import os
+import time
+import tempfile
+import mysql.connector
 from datetime import datetime
+from classes.batch_writer import BatchFailure
 
-class RERAClasses:
-    def __init__(self, db_handler):
-        self.db = db_handler
+DEFAULT_CHUNK_SIZE = 1000
+# 1148/3948: local infile disabled on the server, 2068: rejected by the client (allow_local_infile off)
+LOCAL_INFILE_ERRNOS = {1148, 2068, 3948}
+LOAD_METHODS = ("load_data_local_infile", "executemany")
+# (table, method) -> rows/s of the last upload loaded that way; the baseline the other method is compared with
+LOAD_RATES = {}
 
-    def insert_rera_data(self, df: pd.DataFrame) -> int:
-        inserted = 0
-        insert_query = """
-            INSERT INTO rera (xid, rera_no, state, elements_data, created_at)
-            VALUES (%s, %s, %s, %s, %s)
-        """
-        for _, row in df.iterrows():
-            if pd.isna(row["xid"]) or pd.isna(row["rera_no"]):
-                continue
-
-            # Build elements_data JSON by excluding known columns
-            known_columns = {"xid", "rera_no", "state"}
-            elements = {
-                k: row[k] for k in df.columns
-                if k not in known_columns and not pd.isna(row[k])
-            }
-            elements_json = json.dumps(elements, ensure_ascii=False)
-
-            values = (
-                row["xid"],
-                row["rera_no"],
-                row["state"] if not pd.isna(row["state"]) else None,
-                elements_json,
-                datetime.now(),
-            )
-            self.db.insert(insert_query, values)
-            inserted += 1
 
-        return inserted
-    def insert_housing_data(self, df: pd.DataFrame) -> int:
-        inserted = 0
-
-        for _, row in df.iterrows():
-            if pd.isna(row["XID"]) or pd.isna(row["RERA"]):
-                continue
-
-            # Known columns
-            known_columns = {"XID", "RERA"}
-            data_columns = {
-                k.replace(" - ", "_").replace(" ", "_").replace("-","_"): row[k]
-                #k.replace("-", "_"): row[k]                 
-                for k in df.columns if k not in known_columns and not pd.isna(row[k])
-            }
+def sanitize_housing_column(name):
+    return name.replace(" - ", "_").replace(" ", "_").replace("-", "_")
 
-            # Prepare final insert dictionary
-            insert_data = {
-                "xid": row["XID"],
-                "rera_no": row["RERA"],
-                **data_columns
-            }
 
-            columns = ", ".join(insert_data.keys())
-            placeholders = ", ".join(["%s"] * len(insert_data))
-            values = list(insert_data.values())
+def sanitize_99acres_column(name):
+    return name.replace(" - ", "_").replace(" ", "_")
 
-            insert_query = f"""
-                INSERT INTO housing_table ({columns})
-                VALUES ({placeholders})
-                ON DUPLICATE KEY UPDATE {', '.join([f"{col}=VALUES({col})" for col in insert_data if col != 'xid'])}
-            """
-            print(insert_query) 
-            self.db.insert(insert_query, values)
-            inserted += 1
 
-        return inserted
-    def insert_magicbrics_data(self, df: pd.DataFrame) -> int:
-        inserted = 0
+def sanitize_listing_column(name):
+    return name.replace(" ", "_")
 
-        for _, row in df.iterrows():
-            if pd.isna(row["XID"]) or pd.isna(row["RERA Number"]):
-                continue
 
-            # Known columns
-            known_columns = {"XID", "RERA Number"}
-            data_columns = {
-                k.replace(" ", "_"): row[k]
-                for k in df.columns if k not in known_columns and not pd.isna(row[k])
-            }
+def clean_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # Python objects with None for NA, ready for the MySQL driver
+    return df.astype(object).where(df.notna(), None)
 
-            # Prepare final insert dictionary
-            insert_data = {
-                "xid": row["XID"],
-                "rera_no": row["RERA Number"],
-                **data_columns
-            }
 
-            columns = ", ".join(insert_data.keys())
-            placeholders = ", ".join(["%s"] * len(insert_data))
-            values = list(insert_data.values())
+def frame_to_rows(df: pd.DataFrame) -> list:
+    return list(clean_frame(df).itertuples(index=False, name=None))
 
-            insert_query = f"""
-                INSERT INTO magic_bricks_table ({columns})
-                VALUES ({placeholders})
-                ON DUPLICATE KEY UPDATE {', '.join([f"{col}=VALUES({col})" for col in insert_data if col != 'xid'])}
-            """
 
-            self.db.insert(insert_query, values)
-            inserted += 1
+def infile_field(value):
+    # Every value quoted so only a bare NULL is read back as NULL (the file uses ESCAPED BY '')
+    if value is None:
+        return "NULL"
+    return '"' + str(value).replace('"', '""') + '"'
 
-        return inserted
-    def insert_squareyards_data(self, df: pd.DataFrame) -> int:
-        inserted = 0
 
-        for _, row in df.iterrows():
-            if pd.isna(row["XID"]) or pd.isna(row["RERA Number"]):
-                continue
+def write_infile(rows, path):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for row in rows:
+            f.write(",".join(infile_field(v) for v in row))
+            f.write("\n")
 
-            # Known columns
-            known_columns = {"XID", "RERA Number"}
-            data_columns = {
-                k.replace(" ", "_"): row[k]
-                for k in df.columns if k not in known_columns and not pd.isna(row[k])
-            }
 
-            # Prepare final insert dictionary
-            insert_data = {
-                "xid": row["XID"],
-                "rera_no": row["RERA Number"],
-                **data_columns
+class RERAClasses:
+    def __init__(self, db_handler, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.db = db_handler
+        self.chunk_size = chunk_size
+        self.last_skipped = 0
+        self.last_rows_read = 0
+        self.last_load_stats = None
+        self.last_failures = []
+
+    def insert_chunks(self, method_name, chunks, **kwargs) -> int:
+        # Push each DataFrame chunk through one uploader, keeping running totals across chunks.
+        # A chunk that fails is rolled back and recorded in last_failures; later chunks still run.
+        inserted = skipped = rows_read = 0
+        load_rows = load_seconds = 0
+        load_stats = None
+        fallback_reason = None
+        failures = []
+        for chunk_no, chunk in enumerate(chunks, start=1):
+            self.last_load_stats = None
+            try:
+                inserted += getattr(self, method_name)(chunk, **kwargs)
+            except mysql.connector.Error as err:
+                failed_rows = self.last_rows_read - self.last_skipped
+                failures.append(BatchFailure(method_name, chunk_no, failed_rows, err))
+                print(f"❌ {method_name} chunk {chunk_no} failed ({failed_rows} rows): {err}")
+            rows_read += self.last_rows_read
+            skipped += self.last_skipped
+            if self.last_load_stats:
+                load_stats = self.last_load_stats
+                load_rows += load_stats["rows"]
+                load_seconds += load_stats["seconds"]
+                fallback_reason = fallback_reason or load_stats["fallback_reason"]
+            print(f"  [CHUNK] {rows_read} rows read, {inserted} inserted, {skipped} skipped")
+
+        self.last_rows_read = rows_read
+        self.last_skipped = skipped
+        self.last_failures = failures
+        if load_stats:
+            table, method = load_stats["table"], load_stats["method"]
+            rows_per_sec = round(load_rows / load_seconds) if load_seconds > 0 else None
+            baseline_method = next(m for m in LOAD_METHODS if m != method)
+            load_stats = {
+                "table": table,
+                "method": method,
+                "rows": load_rows,
+                "seconds": round(load_seconds, 3),
+                "rows_per_sec": rows_per_sec,
+                "fallback_reason": fallback_reason,
+                "baseline_method": baseline_method,
+                "baseline_rows_per_sec": LOAD_RATES.get((table, baseline_method)),
             }
+            if rows_per_sec:
+                LOAD_RATES[(table, method)] = rows_per_sec
+        self.last_load_stats = load_stats
+        return inserted
 
-            columns = ", ".join(insert_data.keys())
-            placeholders = ", ".join(["%s"] * len(insert_data))
-            values = list(insert_data.values())
-
-            insert_query = f"""
-                INSERT INTO square_yards_table ({columns})
-                VALUES ({placeholders})
-                ON DUPLICATE KEY UPDATE {', '.join([f"{col}=VALUES({col})" for col in insert_data if col != 'xid'])}
-            """
+    def _drop_missing_keys(self, df: pd.DataFrame, keys) -> pd.DataFrame:
+        valid = df.dropna(subset=list(keys))
+        self.last_rows_read = len(df)
+        self.last_skipped = len(df) - len(valid)
+        return valid
+
+    def _elements_json(self, df: pd.DataFrame, known_columns) -> list:
+        # Build elements_data JSON by excluding known columns and NA values
+        extra = [k for k in df.columns if k not in known_columns]
+        if not extra:
+            # to_dict("records") of a frame without columns is empty, not one {} per row
+            return ["{}"] * len(df)
+        records = clean_frame(df[extra]).to_dict("records")
+        return [
+            json.dumps({k: v for k, v in rec.items() if v is not None}, ensure_ascii=False)
+            for rec in records
+        ]
+
+    def _upsert_listing(self, df: pd.DataFrame, table, key_map, sanitize) -> int:
+        # key_map: uploaded key column -> table column, e.g. {"XID": "xid", "RERA": "rera_no"}
+        df = self._drop_missing_keys(df, key_map)
+        data_columns = [k for k in df.columns if k not in key_map]
+        columns = list(key_map.values()) + [sanitize(k) for k in data_columns]
+        placeholders = ", ".join(["%s"] * len(columns))
+        # NA cells arrive as NULL; COALESCE keeps the stored value like the old per-row column skip did
+        updates = ", ".join(f"`{col}`=COALESCE(VALUES(`{col}`), `{col}`)" for col in columns if col != 'xid')
+        insert_query = f"""
+            INSERT INTO {table} ({', '.join(f'`{col}`' for col in columns)})
+            VALUES ({placeholders})
+            ON DUPLICATE KEY UPDATE {updates}
+        """
+        rows = frame_to_rows(df[list(key_map) + data_columns])
+        return self.db.insert_many(insert_query, rows, self.chunk_size)
+
+    def _record_load(self, table, method, rows, started, fallback_reason=None):
+        seconds = time.perf_counter() - started
+        self.last_load_stats = {
+            "table": table,
+            "method": method,
+            "rows": rows,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(rows / seconds) if seconds > 0 else None,
+            "fallback_reason": fallback_reason,
+        }
+
+    def _load_infile(self, rows, table, table_columns) -> int:
+        fd, path = tempfile.mkstemp(prefix=f"{table}_", suffix=".csv")
+        os.close(fd)
+        try:
+            write_infile(rows, path)
+            return self.db.load_data_local_infile(path, table, table_columns)
+        finally:
+            os.remove(path)
+
+    def _insert_columns(self, df: pd.DataFrame, table, table_columns, source_columns, fast=False) -> int:
+        # Append-only floor tables: LOAD DATA LOCAL INFILE when asked for, batched inserts otherwise
+        df = self._drop_missing_keys(df, ["XID"])
+        rows = frame_to_rows(df[source_columns])
+        fallback_reason = None
+        if fast and rows:
+            started = time.perf_counter()
+            try:
+                loaded = self._load_infile(rows, table, table_columns)
+                self._record_load(table, "load_data_local_infile", loaded, started)
+                return loaded
+            except mysql.connector.Error as err:
+                if err.errno not in LOCAL_INFILE_ERRNOS:
+                    print(f"❌ LOAD DATA Error: {err}")
+                    raise
+                fallback_reason = str(err)
+                print(f"⚠️ LOAD DATA LOCAL INFILE unavailable, falling back to batched inserts: {err}")
+
+        started = time.perf_counter()
+        insert_query = f"""
+            INSERT INTO {table} ({', '.join(table_columns)})
+            VALUES ({', '.join(['%s'] * len(table_columns))})
+        """
+        inserted = self.db.insert_many(insert_query, rows, self.chunk_size)
+        self._record_load(table, "executemany", inserted, started, fallback_reason)
+        return inserted
 
-            self.db.insert(insert_query, values)
-            inserted += 1
+    def insert_rera_data(self, df: pd.DataFrame) -> int:
+        insert_query = """
+            INSERT INTO rera (xid, rera_no, state, elements_data, created_at)
+            VALUES (%s, %s, %s, %s, %s)
+        """
+        df = self._drop_missing_keys(df, ["xid", "rera_no"])
+        elements = self._elements_json(df, {"xid", "rera_no", "state"})
+        created_at = datetime.now()
+        rows = [
+            (*keys, elements_json, created_at)
+            for keys, elements_json in zip(frame_to_rows(df[["xid", "rera_no", "state"]]), elements)
+        ]
+        return self.db.insert_many(insert_query, rows, self.chunk_size)
 
-        return inserted
-    def ninetynineacres_data(self, df: pd.DataFrame) -> int:
-        inserted = 0
-
-        for _, row in df.iterrows():
-            if pd.isna(row["xid"]) or pd.isna(row["registrationNumber"]):
-                continue
-
-            # Known columns
-            known_columns = {"xid", "registrationNumber"}
-            data_columns = {
-                #k.replace(" ", "_"): row[k]
-                k.replace(" - ", "_").replace(" ", "_"): row[k]
-                for k in df.columns if k not in known_columns and not pd.isna(row[k])
-            }
+    def insert_housing_data(self, df: pd.DataFrame) -> int:
+        return self._upsert_listing(df, "housing_table", {"XID": "xid", "RERA": "rera_no"}, sanitize_housing_column)
 
-            # Prepare final insert dictionary
-            insert_data = {
-                "xid": row["xid"],
-                "rera_no": row["registrationNumber"],
-                **data_columns
-            }
+    def insert_magicbrics_data(self, df: pd.DataFrame) -> int:
+        return self._upsert_listing(df, "magic_bricks_table", {"XID": "xid", "RERA Number": "rera_no"}, sanitize_listing_column)
 
-            columns = ", ".join(insert_data.keys())
-            placeholders = ", ".join(["%s"] * len(insert_data))
-            values = list(insert_data.values())
+    def insert_squareyards_data(self, df: pd.DataFrame) -> int:
+        return self._upsert_listing(df, "square_yards_table", {"XID": "xid", "RERA Number": "rera_no"}, sanitize_listing_column)
 
-            insert_query = f"""
-                INSERT INTO 99acres_table ({columns})
-                VALUES ({placeholders})
-                ON DUPLICATE KEY UPDATE {', '.join([f"{col}=VALUES({col})" for col in insert_data if col != 'xid'])}
-            """
-             
-            self.db.insert(insert_query, values)
-            
-            inserted += 1
+    def ninetynineacres_data(self, df: pd.DataFrame) -> int:
+        return self._upsert_listing(df, "99acres_table", {"xid": "xid", "registrationNumber": "rera_no"}, sanitize_99acres_column)
 
-        return inserted
     def insert_brochure_data(self, df: pd.DataFrame) -> int:
-        inserted = 0
         insert_query = """
             INSERT INTO brochure (xid, rera_no, sy_data)
             VALUES (%s, %s, %s)
         """
-        for _, row in df.iterrows():
-            if pd.isna(row["xid"]) or pd.isna(row["rera_no"]):
-                continue
-
-            # Build elements_data JSON by excluding known columns
-            known_columns = {"xid", "rera_no"}
-            elements = {
-                k: row[k] for k in df.columns
-                if k not in known_columns and not pd.isna(row[k])
-            }
-            elements_json = json.dumps(elements, ensure_ascii=False)
-
-            values = (
-                row["xid"],
-                row["rera_no"],
-                elements_json
-            )
-            self.db.insert(insert_query, values)
-            inserted += 1
-
-        return inserted
+        df = self._drop_missing_keys(df, ["xid", "rera_no"])
+        elements = self._elements_json(df, {"xid", "rera_no"})
+        rows = [
+            (*keys, elements_json)
+            for keys, elements_json in zip(frame_to_rows(df[["xid", "rera_no"]]), elements)
+        ]
+        return self.db.insert_many(insert_query, rows, self.chunk_size)
 # Function of Floor and Tower Tables :
-    def insert_mb_floor_data(self, df: pd.DataFrame) -> int:
-        inserted = 0
-        insert_query = """
-            INSERT INTO mb_floor_table (xid, unit_type, unit_size, area_type, price, possession_date)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        for _, row in df.iterrows():
-            if pd.isna(row["XID"]):
-                continue
-
-            # Build elements_data JSON by excluding known columns
-            '''known_columns = {"xid"}
-            elements = {
-                k: row[k] for k in df.columns
-                if k not in known_columns and not pd.isna(row[k])
-            }
-            elements_json = json.dumps(elements, ensure_ascii=False)'''
-
-            values = (
-                row["XID"],
-                row["Unit Type"],
-                row['Unit Size'], 
-                row['Area Type'], 
-                row['Price'], 
-                row['Possession Date']
-            )
-            self.db.insert(insert_query, values)
-            inserted += 1
-
-        return inserted
-    def insert_housing_floor_data(self, df: pd.DataFrame) -> int:
-        inserted = 0
-        insert_query = """
-            INSERT INTO hosuing_floor_table (xid, Project_Name, Configuration, List_Item, Price)
-            VALUES (%s, %s, %s, %s, %s)
-        """
-        
-        for _, row in df.iterrows():
-            if pd.isna(row["XID"]):
-                continue
- 
-
-            values = (
-                row["XID"],
-                row["Project Name"],
-                row['Configuration'], 
-                row['List Item'], 
-                row['Price'] 
-            )
-            self.db.insert(insert_query, values)
-            inserted += 1
-
-        return inserted 
-    def insert_squareyards_floor_data(self, df: pd.DataFrame) -> int:
-        inserted = 0
-        insert_query = """
-            INSERT INTO sy_floor_table (xid, Project_Name, Unit_Type, Area, price, Area_Type)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        for _, row in df.iterrows():
-            if pd.isna(row["XID"]):
-                continue
-
-            values = (
-                row["XID"],
-                row["Project Name"],
-                row["Unit Type"], 
-                row['Area'], 
-                row['Price'], 
-                row['Area Type']
-            )
-            self.db.insert(insert_query, values)
-            inserted += 1
+    def insert_mb_floor_data(self, df: pd.DataFrame, fast=False) -> int:
+        return self._insert_columns(
+            df, "mb_floor_table",
+            ["xid", "unit_type", "unit_size", "area_type", "price", "possession_date"],
+            ["XID", "Unit Type", "Unit Size", "Area Type", "Price", "Possession Date"],
+            fast,
+        )
+
+    def insert_housing_floor_data(self, df: pd.DataFrame, fast=False) -> int:
+        return self._insert_columns(
+            df, "hosuing_floor_table",
+            ["xid", "Project_Name", "Configuration", "List_Item", "Price"],
+            ["XID", "Project Name", "Configuration", "List Item", "Price"],
+            fast,
+        )
+
+    def insert_squareyards_floor_data(self, df: pd.DataFrame, fast=False) -> int:
+        return self._insert_columns(
+            df, "sy_floor_table",
+            ["xid", "Project_Name", "Unit_Type", "Area", "price", "Area_Type"],
+            ["XID", "Project Name", "Unit Type", "Area", "Price", "Area Type"],
+            fast,
+        )
 
-        return inserted
     def fetch_all_data_by_xid(self, xid):
         result = {}
 
@@ -0,0 +1,128 @@
+import os
+import uuid
+import hashlib
+from classes.db_pool import pooled_connection
+
+# Each uploaded XID set is stored once under a run id; the session, jobs and exports
+# only carry the id and join against audit_run_xids. Tables are created by migrations.py.
+INSERT_CHUNK = 1000
+# Ad-hoc XID sets larger than this are joined through a temporary table instead of an IN list
+XID_IN_LIST_MAX = int(os.getenv("XID_IN_LIST_MAX", "500"))
+TEMP_XIDS_TABLE = "tmp_request_xids"
+STRING_TYPES = {"char", "varchar", "tinytext", "text", "mediumtext", "longtext"}
+
+_string_columns = {}
+
+
+def xid_set_hash(xids):
+    # Identifies the XID set regardless of order or duplicates
+    payload = ",".join(sorted({str(x) for x in xids}))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def create_run(xids) -> str:
+    xids = list(dict.fromkeys(int(x) for x in xids))
+    run_id = uuid.uuid4().hex
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "INSERT INTO audit_runs (run_id, xid_count, xid_hash) VALUES (%s, %s, %s)",
+                (run_id, len(xids), xid_set_hash(xids))
+            )
+            for start in range(0, len(xids), INSERT_CHUNK):
+                cursor.executemany(
+                    "INSERT INTO audit_run_xids (run_id, xid) VALUES (%s, %s)",
+                    [(run_id, xid) for xid in xids[start:start + INSERT_CHUNK]]
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    print(f"✅ Registered run {run_id} with {len(xids)} XIDs")
+    return run_id
+
+
+def get_run(run_id):
+    # {run_id, xid_count, xid_hash, created_at} or None
+    with pooled_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                "SELECT run_id, xid_count, xid_hash, created_at FROM audit_runs WHERE run_id = %s",
+                (run_id,)
+            )
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+
+def run_xids(run_id):
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT xid FROM audit_run_xids WHERE run_id = %s ORDER BY xid", (run_id,))
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+
+def load_temp_xids(cursor, xids, table=TEMP_XIDS_TABLE):
+    # Session-scoped, so concurrent pooled connections never see each other's sets
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS `{table}`")
+    cursor.execute(f"CREATE TEMPORARY TABLE `{table}` (xid BIGINT NOT NULL PRIMARY KEY)")
+    xids = list(dict.fromkeys(int(x) for x in xids))
+    for start in range(0, len(xids), INSERT_CHUNK):
+        cursor.executemany(f"INSERT INTO `{table}` (xid) VALUES (%s)", [(x,) for x in xids[start:start + INSERT_CHUNK]])
+
+
+def uses_temp_xids(xids, run_id=None):
+    return not run_id and len(xids) > XID_IN_LIST_MAX
+
+
+def string_column(cursor, table, column):
+    # (charset, collation) when table.column is a string type, None for numeric columns; cached per process
+    key = (table, column)
+    if key not in _string_columns:
+        cursor.execute(
+            "SELECT DATA_TYPE, CHARACTER_SET_NAME, COLLATION_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (table, column)
+        )
+        row = cursor.fetchone()
+        if isinstance(row, dict):
+            row = (row["DATA_TYPE"], row["CHARACTER_SET_NAME"], row["COLLATION_NAME"])
+        _string_columns[key] = (row[1], row[2]) if row and row[0].lower() in STRING_TYPES else None
+    return _string_columns[key]
+
+
+def registry_xid(ref, collation=None):
+    # The registry's BIGINT xid, cast to the string column it is compared with (see string_column).
+    # Comparing BIGINT with VARCHAR converts both sides to numbers and skips the column's index.
+    if not collation:
+        return ref
+    charset, name = collation
+    return f"CAST({ref} AS CHAR CHARACTER SET {charset}) COLLATE {name}"
+
+
+def run_join(column, collation=None):
+    # (join clause, where clause) restricting `column` to a run's XIDs; the run id is the only param
+    return f"JOIN audit_run_xids r ON {column} = {registry_xid('r.xid', collation)}", "r.run_id = %s"
+
+
+def xid_filter(cursor, xids, column, run_id=None, temp_loaded=False, collation=None):
+    # Restricts `column` to an XID set. Returns (join clause, where clause, params):
+    # a join on audit_run_xids for a registered run, an IN list for small ad-hoc sets,
+    # otherwise a join on a temporary table loaded with the set (once, if temp_loaded).
+    # Pass the column's string_column() collation when it is not numeric.
+    if run_id:
+        join, where = run_join(column, collation)
+        return join, where, (run_id,)
+    if not uses_temp_xids(xids):
+        params = tuple(str(x) for x in xids) if collation else tuple(xids)
+        return "", f"{column} IN ({','.join(['%s'] * len(xids))})", params
+    if not temp_loaded:
+        load_temp_xids(cursor, xids)
+    return f"JOIN `{TEMP_XIDS_TABLE}` x ON {column} = {registry_xid('x.xid', collation)}", "1 = 1", ()
@@ -1,14 +1,24 @@
 import os
 import json
-import mysql.connector
 import pandas as pd
+import numpy as np
 from pydantic import BaseModel
 from typing import Union, List, Optional
 from google import genai
 from google.genai import types
 import dotenv
 import re
+import sys
+import time
 from collections import Counter
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from classes.db_pool import get_connection, pool_size
+from classes.batch_writer import bulk_join_update
+from classes.export_cache import bump_export_versions
+from classes.norm_cache import get_norm_cache
+from classes.local_normalizers import has_local_normalizer, normalize_rows_locally
+from migrations import require_schema
 
 dotenv.load_dotenv()
 
@@ -21,36 +31,114 @@ class DataPointScore(BaseModel):
     c2_normalised: Optional[str]
     c3_normalised: Optional[str]
 
+class NormalizedValue(BaseModel):
+    id: int
+    normalised: Optional[str]
+
+NA_VARIANTS = frozenset(['not available', 'n/a', 'na', 'not found', 'null', 'none', ''])
+_NON_WORD = re.compile(r'[^\w.]')
+
+# Keyword rules checked in order against the data point name; the first hit picks the matcher
+MATCH_RULES = [
+    (('Project Size - Unit Count', 'Project Size - Tower Count', 'Builder Established Date'), 'numeric_exact'),
+    (('Photos', 'Videos', 'Review Count', 'Builder Project Count', 'Amenities Count'), 'numeric_gte'),
+    (('Project Name', 'Completion date', 'RERA', 'Possession Status', 'Property Type', 'Configs',
+      'Avg Price psft Type', 'Builder Name', 'Project Address'), 'exact_string'),
+    (('Project Area',), 'project_area_match'),
+    (('Avg Price psft',), 'avg_price_psft_match'),
+    (('Price Range',), 'project_price_range_match'),
+    (('RERA Number',), 'rera_number_match'),
+]
+DEFAULT_MATCH_METHOD = 'exact_string'
+
+# Match method -> ScoreCalculator method comparing one (ref, comp) pair
+MATCHERS = {
+    'exact_string': 'exact_string_match',
+    'numeric_gte': 'numeric_gte_match',
+    'numeric_exact': 'numeric_exact_match',
+    'project_area_match': 'project_area_match',
+    'avg_price_psft_match': 'avg_price_psft_match',
+    'project_price_range_match': 'project_price_range_match',
+    'rera_number_match': 'rera_number_match',
+}
+
+@lru_cache(maxsize=65536)
+def normalize_text(text: str) -> Optional[str]:
+    # Memoized: audit tables repeat the same few values across thousands of rows
+    str_val = text.strip().lower()
+    if str_val in NA_VARIANTS:
+        return None
+    # Removing special characters and spaces
+    normalized = _NON_WORD.sub('', str_val)
+    return sys.intern(normalized) if normalized else None
+
+CHARS_PER_TOKEN = 4  # Rough estimate for JSON payloads
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+class ChunkNormalizationError(Exception):
+    # Raised after the successful chunks of a data point were yielded; failures is {chunk_no: error}
+    def __init__(self, data_point, failures, total):
+        self.data_point = data_point
+        self.failures = failures
+        summary = "; ".join(f"chunk {chunk_no}: {error}" for chunk_no, error in sorted(failures.items()))
+        super().__init__(f"{data_point}: {len(failures)} of {total} chunk(s) failed after retries: {summary}")
+
 class GeminiClient:
-    def __init__(self, model_name='gemini-2.5-flash', prompt_path='gemini_prompts.json'):
+    def __init__(self, model_name='gemini-2.5-flash', prompt_path='gemini_prompts.json',
+                 chunk_token_budget=None, chunk_max_rows=None, chunk_concurrency=None, max_retries=None):
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("GEMINI_API_KEY not set")
         self.__client = genai.Client(api_key=api_key)
         self.__model_name = model_name
         self.__prompt_path = prompt_path
+        # Rows for one data point are split into requests of at most this many estimated input tokens
+        self.chunk_token_budget = chunk_token_budget or int(os.getenv("GEMINI_CHUNK_TOKENS", "6000"))
+        # Output grows with the row count, so rows per request are capped as well
+        self.chunk_max_rows = chunk_max_rows or int(os.getenv("GEMINI_CHUNK_MAX_ROWS", "200"))
+        self.chunk_concurrency = chunk_concurrency or int(os.getenv("GEMINI_CHUNK_CONCURRENCY", "4"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("GEMINI_CHUNK_RETRIES", "2"))
 
     def __load_prompt(self, prompt_key: str) -> str:
         with open(self.__prompt_path, 'r') as file:
             data = json.load(file)
         return data.get(prompt_key, "")
 
-    def get_norm_values(self, input_df: pd.DataFrame, data_point: str, instruction: str) -> List[DataPointScore]:
-        prompt = self.__load_prompt("data_point_normalizer")
-       
+    def chunk_rows(self, input_df: pd.DataFrame, instruction: str) -> List[str]:
+        # Split rows into JSON arrays that fit the token budget next to the instruction
+        budget = max(1, self.chunk_token_budget - estimate_tokens(instruction))
+        row_jsons = input_df.to_json(orient='records', lines=True).splitlines()
+        chunks, current, current_tokens = [], [], 0
+        for row_json in row_jsons:
+            row_tokens = estimate_tokens(row_json)
+            if current and (current_tokens + row_tokens > budget or len(current) >= self.chunk_max_rows):
+                chunks.append("[" + ",".join(current) + "]")
+                current, current_tokens = [], 0
+            current.append(row_json)
+            current_tokens += row_tokens
+        if current:
+            chunks.append("[" + ",".join(current) + "]")
+        return chunks
+
+    def __normalize_chunk(self, chunk_json: str, data_point: str, instruction: str,
+                          prompt_key="data_point_normalizer", schema=DataPointScore) -> list:
+        prompt = self.__load_prompt(prompt_key)
+
         contents = [
             types.Content(role="user", parts=[
                 types.Part.from_text(text=instruction)
             ]),
             types.Content(role="user", parts=[
-                types.Part.from_text(text=input_df.to_json(orient='records'))
+                types.Part.from_text(text=chunk_json)
             ])
         ]
 
         config = types.GenerateContentConfig(
             temperature=0.8,
             response_mime_type="application/json",
-            response_schema=list[DataPointScore],
+            response_schema=list[schema],
             system_instruction=[types.Part.from_text(text=prompt)],
         )
 
@@ -67,30 +155,73 @@ class GeminiClient:
 
         try:
             parsed = json.loads(raw_text)
-            return [DataPointScore(**item) for item in parsed]
+            return [schema(**item) for item in parsed]
         except Exception as e:
             print(f"Validation failed: {e}")
             raise
 
+    def __normalize_chunk_with_retry(self, chunk_no, chunk_json, data_point, instruction, prompt_key, schema):
+        # A failed chunk is retried on its own, the rest of the data point is unaffected
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.__normalize_chunk(chunk_json, data_point, instruction, prompt_key, schema)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Retrying {data_point} chunk {chunk_no} (attempt {attempt + 2}): {e}")
+                time.sleep(2 ** attempt)
+
+    def __iter_chunks(self, input_df, data_point, instruction, prompt_key, schema):
+        chunks = self.chunk_rows(input_df, instruction)
+        print(f"Normalizing {data_point}: {len(input_df)} rows in {len(chunks)} chunks")
+        if len(chunks) == 1:
+            yield 0, self.__normalize_chunk_with_retry(0, chunks[0], data_point, instruction, prompt_key, schema)
+            return
+        with ThreadPoolExecutor(max_workers=self.chunk_concurrency, thread_name_prefix="gemini-chunk") as executor:
+            futures = {
+                executor.submit(self.__normalize_chunk_with_retry, chunk_no, chunk_json,
+                                data_point, instruction, prompt_key, schema): chunk_no
+                for chunk_no, chunk_json in enumerate(chunks)
+            }
+            # A chunk that still fails after its retries does not discard the others:
+            # they are yielded (and written and cached by the caller), the failures raised at the end
+            failures = {}
+            for future in as_completed(futures):
+                chunk_no = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"❌ {data_point} chunk {chunk_no} failed: {e}")
+                    failures[chunk_no] = e
+                    continue
+                yield chunk_no, results
+        if failures:
+            raise ChunkNormalizationError(data_point, failures, len(chunks))
+
+    def iter_norm_values(self, input_df: pd.DataFrame, data_point: str, instruction: str):
+        # Yields (chunk_no, results) as chunks finish, chunks run concurrently
+        yield from self.__iter_chunks(input_df, data_point, instruction, "data_point_normalizer", DataPointScore)
+
+    def iter_distinct_norm_values(self, values: List[str], data_point: str, instruction: str):
+        # Yields {raw value: normalised} per chunk; each distinct raw value is sent once
+        input_df = pd.DataFrame({"id": range(len(values)), "value": values})
+        for chunk_no, results in self.__iter_chunks(input_df, data_point, instruction, "value_normalizer", NormalizedValue):
+            yield chunk_no, {values[r.id]: r.normalised for r in results if 0 <= r.id < len(values)}
+
 class ScoreCalculator:
     def __init__(self):
-        pass
+        # data point name -> (match method, bound matcher), resolved once per data point
+        self._matchers = {}
     
     def normalize_value(self, value):
 
-        if value is None or pd.isna(value):
+        if value is None:
             return None
-        
-        str_val = str(value).strip().lower()
-        
-        # Check for N/A variants
-        na_variants = ['not available', 'n/a', 'na', 'not found', 'null', 'none', '']
-        if str_val in na_variants:
-            return None
-            
-        # Removing special characters and spaces 
-        normalized = re.sub(r'[^\w.]', '', str_val)
-        return normalized if normalized else None
+        if not isinstance(value, str):
+            if pd.isna(value):
+                return None
+            value = str(value)
+        return normalize_text(value)
     
     def is_numeric(self, value):
 
@@ -291,24 +422,16 @@ class ScoreCalculator:
         except (ValueError, TypeError):
             return False
     
-    def calculate_consensus(self, comparables):
+    def calculate_consensus(self, comparables, normalized=None):
         #Calculate consensus value and score
-        valid_comparables = []
-        
-        for comp in comparables:
-            normalized = self.normalize_value(comp)
-            if normalized is not None:
-                valid_comparables.append(comp)  
-        
-        if not valid_comparables:
-            return None, 0
-        
+        if normalized is None:
+            normalized = [self.normalize_value(comp) for comp in comparables]
+
         # Count occurrences
         normalized_counts = Counter()
         value_map = {}  # Map normalized -> original
         
-        for val in valid_comparables:
-            norm_val = self.normalize_value(val)
+        for val, norm_val in zip(comparables, normalized):
             if norm_val:
                 normalized_counts[norm_val] += 1
                 if norm_val not in value_map:
@@ -331,59 +454,38 @@ class ScoreCalculator:
             
         return consensus_value, consensus_score
     
+    def match_method_for(self, data_point_name):
+        for keywords, match_method in MATCH_RULES:
+            if any(keyword in data_point_name for keyword in keywords):
+                return match_method
+        return DEFAULT_MATCH_METHOD
+
+    def matcher_for(self, data_point_name):
+        # Returns (match method, matcher callable) for a data point
+        if data_point_name not in self._matchers:
+            match_method = self.match_method_for(data_point_name)
+            self._matchers[data_point_name] = (match_method, getattr(self, MATCHERS[match_method]))
+        return self._matchers[data_point_name]
+
     def calculate_score(self, row, data_point_name):
         # Calculating score for a each row
         ref_val = row['ref_normalised']
         comparables = [row['c1_normalised'], row['c2_normalised'], row['c3_normalised']]
-        
-        if any(keyword in data_point_name for keyword in ['Project Size - Unit Count', 'Project Size - Tower Count','Builder Established Date']):
-            match_method = 'numeric_exact'
-        elif any(keyword in data_point_name for keyword in ['Photos', 'Videos', 'Review Count', 'Builder Project Count', 'Amenities Count']):
-            match_method = 'numeric_gte'
-        elif any(keyword in data_point_name for keyword in ['Project Name', 'Completion date', 'RERA', 'Possession Status','Property Type','Configs','Avg Price psft Type','Builder Name','Project Address']):
-            match_method = 'exact_string'
-        elif any(keyword in data_point_name for keyword in ['Project Area']):
-            match_method = 'project_area_match'
-        elif 'Avg Price psft' in data_point_name:
-            match_method = 'avg_price_psft_match'
-        elif 'Price Range' in data_point_name:
-            match_method = 'project_price_range_match'
-        elif 'RERA Number' in data_point_name:
-            match_method = 'rera_number_match'
-        else:
-            match_method = 'exact_string'
+        _, matcher = self.matcher_for(data_point_name)
+        normalized = [self.normalize_value(comp) for comp in comparables]
         
         # Check if ref value is N/A
-        if self.normalize_value(ref_val) is None:
-            score = 0
-        else:
-            score = 0
-            for comp_val in comparables:
-                if self.normalize_value(comp_val) is not None:  
-                    if match_method == 'exact_string':
-                        if self.exact_string_match(ref_val, comp_val):
-                            score += 1
-                    elif match_method == 'numeric_gte':
-                        if self.numeric_gte_match(ref_val, comp_val):
-                            score += 1
-                    elif match_method == 'numeric_exact':
-                        if self.numeric_exact_match(ref_val, comp_val):
-                            score += 1
-                    elif match_method == 'project_area_match':
-                        if self.project_area_match(ref_val, comp_val):
-                            score += 1
-                    elif match_method == 'avg_price_psft_match':
-                        if self.avg_price_psft_match(ref_val, comp_val):
-                            score += 1
-                    elif match_method == 'project_price_range_match':
-                        if self.project_price_range_match(ref_val, comp_val):
-                            score += 1
+        score = 0
+        if self.normalize_value(ref_val) is not None:
+            for comp_val, comp_norm in zip(comparables, normalized):
+                if comp_norm is not None and matcher(ref_val, comp_val):
+                    score += 1
         
         # Calculating den 
-        den = sum(1 for comp in comparables if self.normalize_value(comp) is not None)
+        den = sum(1 for comp_norm in normalized if comp_norm is not None)
         
         # Calculating consensus
-        consensus_value, consensus_score = self.calculate_consensus(comparables)
+        consensus_value, consensus_score = self.calculate_consensus(comparables, normalized)
         
         return {
             'data_point_name': data_point_name,
@@ -394,20 +496,156 @@ class ScoreCalculator:
             'consensus_score': consensus_score
         }
 
+    # Batch scoring: same results as calculate_score, computed column-wise per data point
+
+    def normalize_column(self, values):
+        # normalize_value over a whole column; returns an object array of str or None
+        series = pd.Series(values, dtype=object)
+        missing = series.isna().to_numpy()
+        text = series.where(~missing, "").astype(str).str.strip().str.lower()
+        missing = missing | text.isin(NA_VARIANTS).to_numpy()
+        normalized = text.str.replace(r'[^\w.]', '', regex=True)
+        missing = missing | (normalized == "").to_numpy()
+        return np.where(missing, None, normalized.to_numpy(dtype=object))
+
+    def float_column(self, normalized):
+        # float() of each distinct value, as is_numeric/float() would do; NaN where not numeric
+        floats = {}
+        for value in set(normalized.tolist()) - {None}:
+            try:
+                floats[value] = float(value)
+            except (ValueError, TypeError):
+                pass
+        numeric = np.array([value in floats for value in normalized.tolist()], dtype=bool)
+        as_float = pd.Series(normalized, dtype=object).map(floats).to_numpy(dtype=float, na_value=np.nan)
+        return as_float, numeric
+
+    def match_column(self, match_method, ref_raw, comp_raw, ref_norm, comp_norm, active):
+        # Returns (matched, failed) boolean arrays for one comparable column
+        failed = np.zeros(len(active), dtype=bool)
+        if match_method == 'exact_string':
+            return active & (ref_norm == comp_norm), failed
+
+        if match_method in ('numeric_gte', 'numeric_exact', 'project_area_match'):
+            ref_f, ref_numeric = self.float_column(ref_norm)
+            comp_f, comp_numeric = self.float_column(comp_norm)
+            numeric = active & ref_numeric & comp_numeric
+            with np.errstate(invalid='ignore'):
+                if match_method == 'numeric_gte':
+                    matched = ref_f >= comp_f
+                elif match_method == 'numeric_exact':
+                    matched = comp_f == ref_f
+                else:
+                    # Python round() per distinct ref value keeps the bounds identical to project_area_match
+                    bounds = {}
+                    for value in set(ref_norm[numeric].tolist()):
+                        ref_num = float(value)
+                        bounds[value] = (round(ref_num * 0.9, 2), round(ref_num * 1.1, 2))
+                    no_bounds = (np.nan, np.nan)
+                    lower, upper = np.array([bounds.get(v, no_bounds) for v in ref_norm.tolist()], dtype=float).reshape(-1, 2).T
+                    matched = (lower <= comp_f) & (comp_f <= upper)
+            return numeric & matched, failed
+
+        # Range/price matchers work on raw strings: evaluate each distinct (ref, comp) pair once
+        matcher = getattr(self, MATCHERS[match_method])
+        matched = np.zeros(len(active), dtype=bool)
+        outcomes = {}
+        for i in np.flatnonzero(active):
+            pair = (ref_raw[i], comp_raw[i])
+            if pair not in outcomes:
+                try:
+                    outcomes[pair] = bool(matcher(*pair))
+                except Exception as e:
+                    outcomes[pair] = e
+            outcome = outcomes[pair]
+            if isinstance(outcome, Exception):
+                failed[i] = True
+            else:
+                matched[i] = outcome
+        return matched, failed
+
+    def consensus_columns(self, comp_raw, comp_norm, comp_valid):
+        # Mode of the normalized comparables; ties go to the first occurrence like Counter
+        n = len(comp_valid[0])
+        counts = []
+        for i in range(len(comp_norm)):
+            count = np.zeros(n, dtype=int)
+            for j in range(len(comp_norm)):
+                count += comp_valid[i] & comp_valid[j] & (comp_norm[i] == comp_norm[j])
+            counts.append(count)
+        counts = np.vstack(counts)
+        consensus_score = counts.max(axis=0)
+        winner = np.argmax(counts == consensus_score, axis=0)
+        raw = np.vstack(comp_raw)
+        consensus_value = raw[winner, np.arange(n)]
+        consensus_value = np.where(consensus_score <= 1, "N/A", consensus_value)
+        any_valid = np.any(np.vstack(comp_valid), axis=0)
+        consensus_value = np.where(any_valid, consensus_value, None)
+        return consensus_value, consensus_score
+
+    def calculate_scores(self, rows, data_point_name):
+        # rows: DataFrame or list of dicts with index_value, ref_normalised, c1/c2/c3_normalised
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        if df.empty:
+            return []
+        match_method, _ = self.matcher_for(data_point_name)
+
+        ref_raw = df['ref_normalised'].to_numpy(dtype=object)
+        ref_norm = self.normalize_column(ref_raw)
+        ref_valid = pd.notna(ref_norm)
+
+        score = np.zeros(len(df), dtype=int)
+        failed = np.zeros(len(df), dtype=bool)
+        comp_raw, comp_norm, comp_valid = [], [], []
+        for col in ('c1_normalised', 'c2_normalised', 'c3_normalised'):
+            raw = df[col].to_numpy(dtype=object)
+            norm = self.normalize_column(raw)
+            valid = pd.notna(norm)
+            matched, errors = self.match_column(match_method, ref_raw, raw, ref_norm, norm, ref_valid & valid)
+            score += matched
+            failed |= errors
+            comp_raw.append(raw)
+            comp_norm.append(norm)
+            comp_valid.append(valid)
+
+        den = np.sum(comp_valid, axis=0)
+        consensus_value, consensus_score = self.consensus_columns(comp_raw, comp_norm, comp_valid)
+
+        results = []
+        for i, index_value in enumerate(df['index_value'].tolist()):
+            if failed[i]:
+                print(f"Error calculating score for row {index_value}: matcher {match_method} failed")
+                continue
+            results.append({
+                'data_point_name': data_point_name,
+                'index': index_value,
+                'score': int(score[i]),
+                'den': int(den[i]),
+                'consensus_value': consensus_value[i],
+                'consensus_score': int(consensus_score[i])
+            })
+        return results
+
+RAW_VALUE_FIELDS = ('value_99acres', 'c1', 'c2', 'c3')
+# Data points whose comparable normalization depends on the ref value of the same row
+CONTEXT_DEPENDENT_DATA_POINTS = {"project_address"}
+
+def raw_value_key(value):
+    return None if value is None else str(value)
+
 class MySQLProcessor:
     def __init__(self, gemini_client):
         self.client = gemini_client
         self.score_calculator = ScoreCalculator()
-        self.conn = mysql.connector.connect(
-            host=os.getenv("MYSQL_HOST"),
-            user=os.getenv("MYSQL_USER"),
-            password=os.getenv("MYSQL_PASSWORD"),
-            database=os.getenv("MYSQL_DATABASE"),
-            connection_timeout=5,
-            use_pure=True
-        )
+        self.norm_cache = get_norm_cache()
+        self.conn = get_connection()
         self.cursor = self.conn.cursor(dictionary=True)
 
+    def close(self):
+        # Hand the connection back to the shared pool
+        self.cursor.close()
+        self.conn.close()
+
     def fetch_unscored_rows(self, data_point_name):
         query = """
             SELECT * FROM competition_oprns_audit_data
@@ -426,48 +664,179 @@ class MySQLProcessor:
         return self.cursor.fetchall()
 
     def update_normalization_values(self, results: List[DataPointScore]):
-        for r in results:
-            update_query = """
-                UPDATE competition_oprns_audit_data
-                SET ref_normalised = %s, c1_normalised = %s, c2_normalised = %s, c3_normalised = %s, is_scored = 1
-                WHERE index_value = %s AND data_point_name = %s
-            """
-            self.cursor.execute(update_query, (
-                r.ref_normalised,
-                r.c1_normalised,
-                r.c2_normalised,
-                r.c3_normalised,
-                r.index,
-                r.data_point_name
-            ))
-            self.conn.commit()
+        # One join UPDATE per call instead of an UPDATE + commit per row
+        rows = [
+            (r.index, r.data_point_name, r.ref_normalised, r.c1_normalised, r.c2_normalised, r.c3_normalised)
+            for r in results
+        ]
+        bulk_join_update(
+            self.conn, "competition_oprns_audit_data",
+            keys=("index_value", "data_point_name"),
+            columns=("ref_normalised", "c1_normalised", "c2_normalised", "c3_normalised"),
+            rows=rows,
+            assignments=("is_scored = 1",)
+        )
+        bump_export_versions(self.conn, ["competition_oprns_audit_data"])
     
     def update_scoring_values(self, results: list):
         #Update database with scores
+        rows = [
+            (r['index'], r['data_point_name'], r['score'], r['den'], r['consensus_value'], r['consensus_score'])
+            for r in results
+        ]
+        bulk_join_update(
+            self.conn, "competition_oprns_audit_data",
+            keys=("index_value", "data_point_name"),
+            columns=("score", "den", "consensus_value", "consensus_score"),
+            rows=rows
+        )
+        bump_export_versions(self.conn, ["competition_oprns_audit_data"])
+
+    def update_normalized_scores(self, results: List[DataPointScore], scores: dict):
+        # Pipelined write: normalized values and their scores in one join UPDATE.
+        # Rows whose matcher failed keep score NULL and are picked up by process_scoring.
+        rows = []
         for r in results:
-            update_query = """
-                UPDATE competition_oprns_audit_data
-                SET score = %s, den = %s, consensus_value = %s, consensus_score = %s
-                WHERE index_value = %s AND data_point_name = %s
-            """
-            self.cursor.execute(update_query, (
-                r['score'],
-                r['den'],
-                r['consensus_value'],
-                r['consensus_score'],
-                r['index'],
-                r['data_point_name']
+            score = scores.get(r.index, {})
+            rows.append((
+                r.index, r.data_point_name, r.ref_normalised, r.c1_normalised, r.c2_normalised, r.c3_normalised,
+                score.get('score'), score.get('den'), score.get('consensus_value'), score.get('consensus_score')
             ))
-            self.conn.commit()
+        bulk_join_update(
+            self.conn, "competition_oprns_audit_data",
+            keys=("index_value", "data_point_name"),
+            columns=("ref_normalised", "c1_normalised", "c2_normalised", "c3_normalised",
+                     "score", "den", "consensus_value", "consensus_score"),
+            rows=rows,
+            assignments=("is_scored = 1",)
+        )
+        bump_export_versions(self.conn, ["competition_oprns_audit_data"])
+
+    def iter_gemini_results(self, rows, data_point, instruction):
+        # Yields lists of DataPointScore as Gemini chunks complete
+        if data_point in CONTEXT_DEPENDENT_DATA_POINTS:
+            # Comparables are normalized relative to the ref, so only identical rows are merged
+            groups = {}
+            for row in rows:
+                groups.setdefault(tuple(raw_value_key(row[f]) for f in RAW_VALUE_FIELDS), []).append(row)
+            representatives = [members[0] for members in groups.values()]
+            members_by_index = {members[0]['index_value']: members for members in groups.values()}
+            print(f"Dedup {data_point}: {len(rows)} rows -> {len(representatives)} distinct rows")
+            for _, chunk_results in self.client.iter_norm_values(pd.DataFrame(representatives), data_point, instruction):
+                results = []
+                for normalized in chunk_results:
+                    members = members_by_index.get(normalized.index, [])
+                    results.extend(normalized.model_copy(update={"index": m['index_value']}) for m in members)
+                yield results
+            return
 
-    def process_normalization(self, data_point, instruction):
+        # Every distinct raw value across ref/c1/c2/c3 is normalized once and fanned back to the rows.
+        # A row is yielded with the chunk that completes its last missing value.
+        pending = []
+        rows_by_value = {}
+        for pos, row in enumerate(rows):
+            values = {raw_value_key(row[f]) for f in RAW_VALUE_FIELDS} - {None}
+            pending.append(len(values))
+            for value in values:
+                rows_by_value.setdefault(value, []).append(pos)
+        distinct = list(rows_by_value)
+        print(f"Dedup {data_point}: {len(rows) * len(RAW_VALUE_FIELDS)} values -> {len(distinct)} distinct values")
+
+        normalized = {}
+        empty_rows = [row for row, missing in zip(rows, pending) if missing == 0]
+        if empty_rows:
+            yield self.fan_out_distinct(empty_rows, data_point, normalized)
+        if not distinct:
+            return
+        for _, chunk_values in self.client.iter_distinct_norm_values(distinct, data_point, instruction):
+            normalized.update(chunk_values)
+            completed = []
+            for value in chunk_values:
+                for pos in rows_by_value.get(value, ()):
+                    pending[pos] -= 1
+                    if pending[pos] == 0:
+                        completed.append(rows[pos])
+            yield self.fan_out_distinct(completed, data_point, normalized)
+
+    def fan_out_distinct(self, rows, data_point, normalized) -> List[DataPointScore]:
+        results = []
+        for row in rows:
+            raw = [raw_value_key(row[f]) for f in RAW_VALUE_FIELDS]
+            if any(value is not None and value not in normalized for value in raw):
+                # Left unnormalized (is_scored = 0) so the next run picks the row up again
+                continue
+            ref, c1, c2, c3 = (normalized[value] if value is not None else None for value in raw)
+            results.append(DataPointScore(
+                data_point_name=data_point, index=row['index_value'],
+                ref_normalised=ref, c1_normalised=c1, c2_normalised=c2, c3_normalised=c3
+            ))
+        return results
 
+    def iter_normalization(self, data_point, instruction):
+        # Yields batches of normalized rows: local rules and cache hits first, then each Gemini chunk
         rows = self.fetch_unscored_rows(data_point)
         if not rows:
             return
-        df = pd.DataFrame(rows)
-        results = self.client.get_norm_values(df, data_point, instruction)
-        self.update_normalization_values(results)
+
+        # Rule-based data points skip the LLM except for values the rules cannot handle
+        if has_local_normalizer(data_point):
+            handled, rows = normalize_rows_locally(data_point, rows)
+            print(f"Local rules normalized {len(handled)} rows for {data_point}, {len(rows)} left for Gemini")
+            if handled:
+                yield [DataPointScore(**values) for values in handled]
+            if not rows:
+                return
+
+        # Rows whose raw values were normalized before under the same instruction come from the cache
+        keys = [
+            self.norm_cache.make_key(data_point, instruction, row['value_99acres'], row['c1'], row['c2'], row['c3'])
+            for row in rows
+        ]
+        cached = self.norm_cache.get_many(keys)
+        cached_results = [
+            DataPointScore(data_point_name=data_point, index=row['index_value'], **cached[key])
+            for row, key in zip(rows, keys) if key in cached
+        ]
+        miss_rows = [row for row, key in zip(rows, keys) if key not in cached]
+        print(f"Normalization cache for {data_point}: {len(rows) - len(miss_rows)} hits, "
+              f"{len(miss_rows)} misses sent to Gemini ({self.norm_cache.stats()})")
+        if cached_results:
+            yield cached_results
+
+        if miss_rows:
+            key_by_index = {row['index_value']: key for row, key in zip(rows, keys) if key not in cached}
+            for llm_results in self.iter_gemini_results(miss_rows, data_point, instruction):
+                self.norm_cache.put_many(
+                    (key_by_index[r.index], data_point, r.model_dump())
+                    for r in llm_results if r.index in key_by_index
+                )
+                yield llm_results
+
+    def process_normalization(self, data_point, instruction):
+        results = []
+        try:
+            for batch in self.iter_normalization(data_point, instruction):
+                results.extend(batch)
+        except ChunkNormalizationError:
+            # Chunks that succeeded are written even when another chunk failed
+            if results:
+                self.update_normalization_values(results)
+            raise
+        if results:
+            self.update_normalization_values(results)
+
+    def process_pipelined(self, data_point, instruction):
+        # Each normalized batch is scored in memory and written once together with its scores,
+        # while the remaining Gemini chunks are still running
+        written = 0
+        for results in self.iter_normalization(data_point, instruction):
+            if not results:
+                continue
+            frame = pd.DataFrame([{**r.model_dump(exclude={'index'}), 'index_value': r.index} for r in results])
+            scores = {s['index']: s for s in self.score_calculator.calculate_scores(frame, data_point)}
+            self.update_normalized_scores(results, scores)
+            written += len(results)
+        print(f"Normalized and scored {written} rows for {data_point}")
     
     def process_scoring(self, data_point):
 
@@ -476,48 +845,83 @@ class MySQLProcessor:
             print(f"No normalized rows found for scoring: {data_point}")
             return
         
-        results = []
-        for row in rows:
-            try:
-                score_result = self.score_calculator.calculate_score(row, data_point)
-                results.append(score_result)
-            except Exception as e:
-                print(f"Error calculating score for row {row.get('index_value')}: {e}")
+        # Whole data point scored column-wise, rows whose matcher raised are skipped
+        results = self.score_calculator.calculate_scores(rows, data_point)
         
         if results:
             self.update_scoring_values(results)
             print(f"Updated {len(results)} scoring records for {data_point}")
 
-    def process_data_point_complete(self, data_point, instruction):
+    def process_data_point_complete(self, data_point, instruction, pipelined=None):
     #Complete processing for a data point
-        print(f"Processing normalization for: {data_point}")
-        self.process_normalization(data_point, instruction)
-        
+        if pipelined is None:
+            pipelined = os.getenv("PIPELINED_SCORING", "1") == "1"
+        chunk_error = None
+        try:
+            if pipelined:
+                print(f"Processing normalization and scoring for: {data_point}")
+                self.process_pipelined(data_point, instruction)
+            else:
+                print(f"Processing normalization for: {data_point}")
+                self.process_normalization(data_point, instruction)
+        except ChunkNormalizationError as e:
+            # The failed chunks' rows stay unnormalized for the next run; score what was written
+            chunk_error = e
+
+        # Normalized rows that still have no score (matcher errors, earlier runs)
         print(f"Processing scoring for: {data_point}")
         self.process_scoring(data_point)
+        if chunk_error:
+            raise chunk_error
 
-def run_competition_operations():
-    client = GeminiClient()
+def process_data_point_isolated(client, data_point, instruction):
+    # Each data point gets its own processor and pooled connection, so concurrent
+    # workers never share a cursor; their writes touch disjoint data_point_name rows
     processor = MySQLProcessor(client)
-    with open("operation_prompts.json", "r", encoding="utf-8") as file:
-        instructions = json.load(file)
-    for dp, rule in instructions.items():
-        print(f"Processing: {dp}")
-        try:
-            processor.process_data_point_complete(dp, rule)
-        except Exception as e:
-            print(f"Error processing {dp}: {e}")
-
-if __name__ == "__main__":
+    try:
+        processor.process_data_point_complete(data_point, instruction)
+    finally:
+        processor.close()
+
+def competition_workers(requested, concurrent_runs=1):
+    # Every worker holds a pooled connection for its whole data point, Gemini calls included.
+    # Leave COMPETITION_POOL_HEADROOM connections for job progress updates, status polling and
+    # requests, and split the rest between the pipeline jobs that may score at the same time.
+    headroom = int(os.getenv("COMPETITION_POOL_HEADROOM", "2"))
+    limit = max(1, (pool_size() - headroom) // max(1, concurrent_runs))
+    if requested > limit:
+        print(f"⚠️ COMPETITION_CONCURRENCY={requested} capped to {limit} "
+              f"(MYSQL_POOL_SIZE={pool_size()}, headroom {headroom}, {concurrent_runs} concurrent run(s))")
+        return limit
+    return max(1, requested)
+
+def run_competition_operations(progress=None, max_workers=None, concurrent_runs=1):
+    # Returns {data_point: error message} for the data points that failed
+    if max_workers is None:
+        max_workers = int(os.getenv("COMPETITION_CONCURRENCY", "4"))
+    max_workers = competition_workers(max_workers, concurrent_runs)
+    require_schema()
     client = GeminiClient()
-    processor = MySQLProcessor(client)
-    
     with open("operation_prompts.json", "r", encoding="utf-8") as file:
         instructions = json.load(file)
+    errors = {}
+    done = 0
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="data-point") as executor:
+        futures = {}
+        for dp, rule in instructions.items():
+            print(f"Processing: {dp}")
+            futures[executor.submit(process_data_point_isolated, client, dp, rule)] = dp
+        for future in as_completed(futures):
+            dp = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error processing {dp}: {e}")
+                errors[dp] = str(e)
+            done += 1
+            if progress:
+                progress(done, len(instructions))
+    return errors
 
-    for dp, rule in instructions.items():
-        print(f"Processing: {dp}")
-        try:
-            processor.process_data_point_complete(dp, rule)
-        except Exception as e:
-            print(f"Error processing {dp}: {e}")
\ No newline at end of file
+if __name__ == "__main__":
+    run_competition_operations()
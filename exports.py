@@ -0,0 +1,272 @@
+import os
+import csv
+import io
+import tempfile
+import xlsxwriter
+from mysql.connector import FieldType
+from classes.db_pool import get_connection
+
+FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "1000"))  # Rows per fetchmany / CSV chunk
+FILE_CHUNK_BYTES = 64 * 1024
+XLSX_MAX_ROWS = 1048576  # Excel sheet limit, including the header row
+
+# Format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+INTEGER_TYPES = {FieldType.TINY, FieldType.SHORT, FieldType.LONG, FieldType.LONGLONG, FieldType.INT24, FieldType.YEAR}
+FLOAT_TYPES = {FieldType.FLOAT, FieldType.DOUBLE}
+DATETIME_TYPES = {FieldType.DATETIME, FieldType.TIMESTAMP}
+
+# Export kind -> (query joined to a run's XIDs in audit_run_xids, download name)
+EXPORTS = {
+    # Exclude amenities_list from main output
+    "output": (
+        "SELECT a.* FROM competition_oprns_audit_data a JOIN audit_run_xids r ON r.xid = a.index_value "
+        "WHERE r.run_id = %s AND a.data_point_name != 'amenities_list'",
+        "output_results",
+    ),
+    "amenities": (
+        "SELECT a.* FROM competition_amenities a JOIN audit_run_xids r ON r.xid = a.`Index` WHERE r.run_id = %s",
+        "amenities_results",
+    ),
+}
+
+
+# Export kind -> table whose version in export_versions invalidates cached files
+EXPORT_TABLES = {
+    "output": "competition_oprns_audit_data",
+    "amenities": "competition_amenities",
+}
+
+
+def export_query(kind, run_id):
+    query, name = EXPORTS[kind]
+    return query, (run_id,), name
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+
+def open_export_cursor(query, params):
+    # The query runs before the response starts, so SQL errors still reach the error page.
+    # The connection is owned by the export, not the request: close_export_cursor() returns it.
+    conn = get_connection()
+    cursor = conn.cursor(buffered=False)  # Unbuffered: rows stay on the server until fetched
+    try:
+        cursor.execute(query, params)
+    except Exception:
+        cursor.close()
+        conn.close()
+        raise
+    return conn, cursor
+
+
+def close_export_cursor(conn, cursor):
+    try:
+        # A client that disconnects mid-download leaves unread rows on the connection
+        conn.consume_results()
+    except Exception:
+        pass
+    try:
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def iter_rows(cursor, fetch_rows=FETCH_ROWS):
+    # Yields (columns, rows) chunks; the caller owns the cursor and releases it
+    columns = [d[0] for d in cursor.description]
+    while True:
+        rows = cursor.fetchmany(fetch_rows)
+        if not rows:
+            break
+        yield columns, rows
+
+
+class ExportStream:
+    # Chunks read from an open export cursor. close() returns the connection to the pool
+    # whether or not the body was ever iterated, so register it with response.call_on_close.
+    def __init__(self, conn, cursor, chunks):
+        self.conn = conn
+        self.cursor = cursor
+        self.chunks = chunks
+        self.started = False
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.started = True
+        return next(self.chunks)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.started:
+            self.chunks.close()  # Runs the generator's finally, which releases the cursor
+        else:
+            close_export_cursor(self.conn, self.cursor)
+
+
+def stream_csv(query, params, fetch_rows=FETCH_ROWS):
+    # ExportStream of encoded CSV chunks: the header first, then one chunk per fetchmany
+    conn, cursor = open_export_cursor(query, params)
+    columns = [d[0] for d in cursor.description]
+
+    def generate():
+        try:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator="\n")
+            writer.writerow(columns)
+            yield buffer.getvalue().encode("utf-8")
+            for _, rows in iter_rows(cursor, fetch_rows):
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows([csv_value(v) for v in row] for row in rows)
+                yield buffer.getvalue().encode("utf-8")
+        finally:
+            close_export_cursor(conn, cursor)
+
+    return ExportStream(conn, cursor, generate())
+
+
+def write_xlsx(cursor, path, fetch_rows=FETCH_ROWS):
+    # constant_memory flushes each row to disk as soon as the next one starts
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'strings_to_numbers': False,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+    })
+    try:
+        worksheet, row_no = None, XLSX_MAX_ROWS
+        for columns, rows in iter_rows(cursor, fetch_rows):
+            for row in rows:
+                if row_no >= XLSX_MAX_ROWS:
+                    # Continue on a new sheet past Excel's row limit
+                    worksheet = workbook.add_worksheet()
+                    worksheet.write_row(0, 0, columns)
+                    row_no = 1
+                worksheet.write_row(row_no, 0, [csv_value(v) for v in row])
+                row_no += 1
+        if worksheet is None:
+            workbook.add_worksheet().write_row(0, 0, [d[0] for d in cursor.description])
+    finally:
+        workbook.close()
+
+
+def parquet_schema(description):
+    import pyarrow as pa
+    fields = []
+    for column in description:
+        name, type_code = column[0], column[1]
+        if type_code in INTEGER_TYPES:
+            arrow_type = pa.int64()
+        elif type_code in FLOAT_TYPES:
+            arrow_type = pa.float64()
+        elif type_code in DATETIME_TYPES:
+            arrow_type = pa.timestamp('us')
+        elif type_code in (FieldType.DATE, FieldType.NEWDATE):
+            arrow_type = pa.date32()
+        else:
+            # Text, decimals and anything else are written as strings
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def write_parquet(cursor, path, fetch_rows=FETCH_ROWS):
+    # One zstd-compressed row group per fetchmany chunk
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = parquet_schema(cursor.description)
+    text_columns = [i for i, field in enumerate(schema) if pa.types.is_string(field.type)]
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for _, rows in iter_rows(cursor, fetch_rows):
+            columns = [list(values) for values in zip(*rows)]
+            for i in text_columns:
+                columns[i] = [None if v is None else str(csv_value(v)) for v in columns[i]]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+
+class FileStream:
+    # Chunks of a finished, uncached export file. close() deletes the file whether or not the
+    # body was ever iterated, so register it with response.call_on_close like ExportStream.
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        if self.file is None:
+            self.file = open(self.path, "rb")
+        chunk = self.file.read(FILE_CHUNK_BYTES)
+        if not chunk:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.file is not None:
+            self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def render_export(query, params, fmt, path):
+    # XLSX and Parquet are written row by row to a file, their containers are only complete on close
+    writer = {"xlsx": write_xlsx, "parquet": write_parquet}[fmt]
+    conn, cursor = open_export_cursor(query, params)
+    try:
+        writer(cursor, path)
+    finally:
+        close_export_cursor(conn, cursor)
+
+
+def build_export(query, params, fmt, cache=None, key=None):
+    # Returns (path, chunks): a finished file to send from disk, or an ExportStream/FileStream
+    # whose close() must be called once the response is done. With a cache, the rendered file is
+    # stored under `key` for later requests.
+    extension = EXPORT_FORMATS[fmt][1]
+    use_cache = cache is not None and cache.enabled and key is not None
+    if fmt == "csv":
+        stream = stream_csv(query, params)
+        if use_cache:
+            stream.chunks = cache.tee(key, extension, stream.chunks)
+        return None, stream
+
+    if use_cache:
+        path = cache.temp_path(extension)
+    else:
+        fd, path = tempfile.mkstemp(suffix=f".{extension}")
+        os.close(fd)
+    try:
+        render_export(query, params, fmt, path)
+    except Exception:
+        os.remove(path)
+        raise
+    if use_cache:
+        return cache.store(key, extension, path), None
+    return None, FileStream(path)
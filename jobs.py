@@ -0,0 +1,103 @@
+import os
+import uuid
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from classes.db_pool import pooled_connection
+from tableinsertdata import update_matching_score
+from competition_operations import run_competition_operations
+from migrations import require_schema
+
+# Stages of the "Update matching score" pipeline, in order
+STAGE_QUEUED = "queued"
+STAGE_MATCHING = "update_matching_score"
+STAGE_SCORING = "run_competition_operations"
+STAGE_DONE = "done"
+
+
+def _execute(query, params=()):
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            conn.commit()
+        finally:
+            cursor.close()
+
+
+class JobManager:
+    # Runs the matching + scoring pipeline off the request thread. Job state lives in
+    # pipeline_jobs (created by migrations.py) so the status survives page reloads and
+    # is visible to every worker.
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            max_workers = int(os.getenv("PIPELINE_WORKERS", "1"))
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline-job")
+
+    def submit(self, run_id, xid_count) -> str:
+        require_schema()
+        job_id = uuid.uuid4().hex
+        _execute(
+            "INSERT INTO pipeline_jobs (job_id, status, stage, total, run_id) VALUES (%s, %s, %s, %s, %s)",
+            (job_id, "queued", STAGE_QUEUED, xid_count, run_id)
+        )
+        self.executor.submit(self._run, job_id, run_id)
+        print(f"✅ Submitted job {job_id} for run {run_id} ({xid_count} XIDs)")
+        return job_id
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = %s" for name in fields)
+        _execute(f"UPDATE pipeline_jobs SET {assignments} WHERE job_id = %s", (*fields.values(), job_id))
+
+    def _progress(self, job_id, stage):
+        # Best effort: a busy pool must not fail the stage that is reporting progress
+        def report(done, total):
+            try:
+                self._update(job_id, stage=stage, progress=done, total=total)
+            except Exception as e:
+                print(f"⚠️ Could not record progress for job {job_id} ({done}/{total}): {e}")
+        return report
+
+    def _run(self, job_id, run_id):
+        try:
+            self._update(job_id, status="running", stage=STAGE_MATCHING, progress=0)
+            update_matching_score(run_id=run_id, progress=self._progress(job_id, STAGE_MATCHING))
+
+            self._update(job_id, stage=STAGE_SCORING, progress=0, total=0)
+            # Concurrent jobs share the connection pool, see competition_workers()
+            errors = run_competition_operations(progress=self._progress(job_id, STAGE_SCORING),
+                                                concurrent_runs=self.max_workers)
+
+            if errors:
+                # Per data point failures do not stop the run, but are reported on the job
+                error = "; ".join(f"{dp}: {msg}" for dp, msg in errors.items())
+                self._update(job_id, status="completed_with_errors", stage=STAGE_DONE, error=error)
+            else:
+                self._update(job_id, status="completed", stage=STAGE_DONE)
+        except Exception as e:
+            traceback.print_exc()
+            try:
+                self._update(job_id, status="failed", error=str(e))
+            except Exception as update_error:
+                print(f"❌ Could not record failure for job {job_id}: {update_error}")
+
+    def get(self, job_id):
+        require_schema()
+        with pooled_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute(
+                    "SELECT job_id, run_id, status, stage, progress, total, error, created_at, updated_at "
+                    "FROM pipeline_jobs WHERE job_id = %s",
+                    (job_id,)
+                )
+                return cursor.fetchone()
+            finally:
+                cursor.close()
+
+    def get_run_id(self, job_id):
+        job = self.get(job_id)
+        return job["run_id"] if job else None
+
+
+job_manager = JobManager()
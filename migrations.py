@@ -0,0 +1,385 @@
+import sys
+from classes.db_pool import pooled_connection
+from classes.data_point_mapping import SOURCE_TABLES
+from classes.batch_writer import TEXT_TYPES, TEXT_PREFIX  # Index prefix length for TEXT key columns
+from classes.run_registry import run_join, string_column
+from exports import EXPORTS
+
+# Versioned schema migrations: the only place the app's tables are created or altered.
+# Runtime code calls require_schema() and never issues DDL itself.
+#   python migrations.py status    list applied and pending migrations
+#   python migrations.py migrate   apply pending migrations
+#   python migrations.py explain   EXPLAIN the hot queries against the current schema
+#   python migrations.py report    EXPLAIN, migrate, EXPLAIN again and print the plans side by side
+
+FLOOR_TABLES = ["mb_floor_table", "hosuing_floor_table", "sy_floor_table"]
+
+CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+CREATE_AUDIT_TABLE = """
+    CREATE TABLE IF NOT EXISTS competition_oprns_audit_data (
+        index_value BIGINT NOT NULL,
+        data_point_name VARCHAR(128) NOT NULL,
+        value_99acres TEXT,
+        c1 TEXT,
+        c2 TEXT,
+        c3 TEXT,
+        ref_normalised TEXT,
+        c1_normalised TEXT,
+        c2_normalised TEXT,
+        c3_normalised TEXT,
+        is_scored TINYINT NOT NULL DEFAULT 0,
+        score INT,
+        den INT,
+        consensus_value TEXT,
+        consensus_score INT,
+        input_hash CHAR(64),
+        PRIMARY KEY (index_value, data_point_name)
+    )
+"""
+
+CREATE_AMENITIES_TABLE = """
+    CREATE TABLE IF NOT EXISTS competition_amenities (
+        `Index` INT PRIMARY KEY,
+        `99acres` TEXT,
+        `C1` TEXT,
+        `C2` TEXT,
+        `C3` TEXT,
+        `missing_amenities` TEXT
+    )
+"""
+
+CREATE_JOBS_TABLE = """
+    CREATE TABLE IF NOT EXISTS pipeline_jobs (
+        job_id CHAR(32) PRIMARY KEY,
+        status VARCHAR(16) NOT NULL,
+        stage VARCHAR(64) NOT NULL,
+        progress INT NOT NULL DEFAULT 0,
+        total INT NOT NULL DEFAULT 0,
+        error TEXT,
+        run_id CHAR(32),
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+"""
+
+# Each uploaded XID set is stored once under a run id (see classes/run_registry.py)
+CREATE_RUNS_TABLE = """
+    CREATE TABLE IF NOT EXISTS audit_runs (
+        run_id CHAR(32) PRIMARY KEY,
+        xid_count INT NOT NULL,
+        xid_hash CHAR(64) NOT NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+CREATE_RUN_XIDS_TABLE = """
+    CREATE TABLE IF NOT EXISTS audit_run_xids (
+        run_id CHAR(32) NOT NULL,
+        xid BIGINT NOT NULL,
+        PRIMARY KEY (run_id, xid),
+        INDEX idx_audit_run_xids_xid (xid)
+    )
+"""
+
+# Bumped after pipeline writes; cached exports of a table are keyed on its version
+CREATE_VERSIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS export_versions (
+        table_name VARCHAR(64) PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0,
+        updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+"""
+
+
+class SchemaNotReady(RuntimeError):
+    pass
+
+
+def table_exists(cursor, table):
+    cursor.execute(
+        "SELECT COUNT(*) AS n FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,)
+    )
+    return cursor.fetchone()["n"] > 0
+
+
+def column_type(cursor, table, column):
+    cursor.execute(
+        "SELECT DATA_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column)
+    )
+    row = cursor.fetchone()
+    return row["DATA_TYPE"].lower() if row else None
+
+
+def table_indexes(cursor, table):
+    # {index name: (unique, [columns in index order])}
+    cursor.execute(
+        "SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+        (table,)
+    )
+    indexes = {}
+    for row in cursor.fetchall():
+        unique, columns = indexes.setdefault(row["INDEX_NAME"], (not row["NON_UNIQUE"], []))
+        columns.append(row["COLUMN_NAME"])
+    return indexes
+
+
+def has_index(cursor, table, columns, unique=False):
+    # An index whose leading columns are `columns` already serves the same lookups
+    for is_unique, index_columns in table_indexes(cursor, table).values():
+        if unique:
+            if is_unique and index_columns == list(columns):
+                return True
+        elif index_columns[:len(columns)] == list(columns):
+            return True
+    return False
+
+
+def add_index(cursor, table, name, columns, unique=False):
+    if has_index(cursor, table, columns, unique):
+        print(f"  = {table}: index on ({', '.join(columns)}) already present")
+        return
+    parts = []
+    for column in columns:
+        prefix = f"({TEXT_PREFIX})" if column_type(cursor, table, column) in TEXT_TYPES else ""
+        parts.append(f"`{column}`{prefix}")
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    cursor.execute(f"ALTER TABLE `{table}` ADD {kind} `{name}` ({', '.join(parts)})")
+    print(f"  + {table}: {kind.lower()} {name} ({', '.join(parts)})")
+
+
+def add_column(cursor, table, column, definition):
+    if column_type(cursor, table, column) is not None:
+        print(f"  = {table}: column {column} already present")
+        return
+    cursor.execute(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}")
+    print(f"  + {table}: column {column} {definition}")
+
+
+def migration_001_create_audit_tables(cursor):
+    cursor.execute(CREATE_AUDIT_TABLE)
+    cursor.execute(CREATE_AMENITIES_TABLE)
+    # Tables created before this module may lack the key the upserts rely on
+    add_index(cursor, "competition_oprns_audit_data", "uq_audit_index_dp", ["index_value", "data_point_name"], unique=True)
+
+
+def migration_002_audit_scoring_index(cursor):
+    # fetch_unscored_rows (data_point_name, is_scored = 0) and
+    # fetch_normalized_unscored_rows (data_point_name, is_scored = 1, score IS NULL)
+    add_index(cursor, "competition_oprns_audit_data", "idx_audit_dp_scored", ["data_point_name", "is_scored", "score"])
+
+
+def migration_003_xid_indexes(cursor):
+    # Source and floor tables are created by the upload tooling; only index the ones present
+    for table in SOURCE_TABLES + FLOOR_TABLES:
+        if not table_exists(cursor, table):
+            print(f"  - {table}: table not found, skipped")
+            continue
+        if column_type(cursor, table, "xid") is None:
+            print(f"  - {table}: no xid column, skipped")
+            continue
+        add_index(cursor, table, f"idx_{table}_xid", ["xid"])
+
+
+def migration_004_audit_columns(cursor):
+    # Audit tables created by earlier app versions or amenities_competition.py predate these columns.
+    # Existing rows start with a NULL input_hash and are re-queued once on their next upsert.
+    add_column(cursor, "competition_oprns_audit_data", "input_hash", "CHAR(64) NULL")
+    add_column(cursor, "competition_amenities", "missing_amenities", "TEXT")
+
+
+def migration_005_job_and_run_tables(cursor):
+    cursor.execute(CREATE_JOBS_TABLE)
+    cursor.execute(CREATE_RUNS_TABLE)
+    cursor.execute(CREATE_RUN_XIDS_TABLE)
+    cursor.execute(CREATE_VERSIONS_TABLE)
+
+
+MIGRATIONS = [
+    (1, "create audit tables", migration_001_create_audit_tables),
+    (2, "audit scoring index", migration_002_audit_scoring_index),
+    (3, "xid indexes on source and floor tables", migration_003_xid_indexes),
+    (4, "audit input_hash and missing_amenities columns", migration_004_audit_columns),
+    (5, "pipeline jobs, run registry and export versions tables", migration_005_job_and_run_tables),
+]
+
+
+def applied_versions(cursor):
+    cursor.execute(CREATE_MIGRATIONS_TABLE)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row["version"] for row in cursor.fetchall()}
+
+
+def pending_migrations(cursor):
+    # Read-only, unlike applied_versions(): schema_migrations is not created here
+    done = set()
+    if table_exists(cursor, "schema_migrations"):
+        cursor.execute("SELECT version FROM schema_migrations")
+        done = {row["version"] for row in cursor.fetchall()}
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in done]
+
+
+_schema_ready = False
+
+
+def require_schema(conn=None):
+    # Called by the runtime entry points instead of creating tables; checked once per process
+    global _schema_ready
+    if _schema_ready:
+        return
+    if conn is None:
+        with pooled_connection() as conn:
+            pending = _pending_on(conn)
+    else:
+        pending = _pending_on(conn)
+    if pending:
+        names = ", ".join(f"{version:03d} {name}" for version, name in pending)
+        raise SchemaNotReady(f"Database schema is out of date (pending: {names}). Run `python migrations.py migrate`.")
+    _schema_ready = True
+
+
+def _pending_on(conn):
+    cursor = conn.cursor(dictionary=True)
+    try:
+        return pending_migrations(cursor)
+    finally:
+        cursor.close()
+
+
+def migrate(conn, cursor):
+    # Returns the versions applied in this call; each one is recorded as soon as it succeeds
+    done = applied_versions(cursor)
+    applied = []
+    for version, name, migration in MIGRATIONS:
+        if version in done:
+            continue
+        print(f"Applying {version:03d} {name}")
+        migration(cursor)
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        conn.commit()
+        applied.append(version)
+    return applied
+
+
+def hot_queries(cursor):
+    # (label, statement, params) for the queries the pipeline and exports run most
+    queries = [
+        ("fetch_unscored_rows",
+         "SELECT * FROM competition_oprns_audit_data WHERE data_point_name = %s AND is_scored = 0",
+         ("project_name",)),
+        ("fetch_normalized_unscored_rows",
+         "SELECT * FROM competition_oprns_audit_data WHERE data_point_name = %s AND is_scored = 1 AND score IS NULL",
+         ("project_name",)),
+        ("update by (index_value, data_point_name)",
+         "UPDATE competition_oprns_audit_data SET score = score WHERE index_value = %s AND data_point_name = %s",
+         (0, "project_name")),
+        ("competition_amenities by Index",
+         "SELECT * FROM competition_amenities WHERE `Index` = %s",
+         (0,)),
+    ]
+    has_runs = table_exists(cursor, "audit_run_xids")
+    for table in SOURCE_TABLES + FLOOR_TABLES:
+        if table_exists(cursor, table) and column_type(cursor, table, "xid") is not None:
+            queries.append((f"{table} by xid", f"SELECT * FROM `{table}` WHERE xid = %s", ("0",)))
+            if has_runs and table in SOURCE_TABLES:
+                # The statement fetch_source_rows runs for a registered run
+                join, where = run_join("t.`xid`", string_column(cursor, table, "xid"))
+                queries.append((f"fetch_source_rows {table} for a run",
+                                f"SELECT t.* FROM `{table}` t {join} WHERE {where}", ("",)))
+    if has_runs:
+        # The amenities export is also the amenity fetch update_matching_score runs for a run
+        queries.append(("output export for a run", EXPORTS["output"][0], ("",)))
+        queries.append(("amenities fetch / export for a run", EXPORTS["amenities"][0], ("",)))
+    return queries
+
+
+def explain(cursor, statement, params):
+    # One line per plan row: table, access type, key and estimated rows
+    try:
+        cursor.execute(f"EXPLAIN {statement}", params)
+        rows = cursor.fetchall()
+    except Exception as e:
+        return [f"EXPLAIN failed: {e}"], False
+    lines, indexed = [], True
+    for row in rows:
+        access = row.get("type") or "-"
+        if access == "ALL":
+            indexed = False
+        lines.append(f"{row.get('table')}: type={access} key={row.get('key')} rows={row.get('rows')} "
+                     f"extra={row.get('Extra') or '-'}")
+    return lines, indexed
+
+
+def explain_all(cursor):
+    plans = {}
+    for label, statement, params in hot_queries(cursor):
+        plans[label] = explain(cursor, statement, params)
+    return plans
+
+
+def print_plans(plans, title):
+    print(f"\n== {title} ==")
+    for label, (lines, indexed) in plans.items():
+        print(f"{'✅' if indexed else '⚠️'} {label}")
+        for line in lines:
+            print(f"    {line}")
+
+
+def print_report(before, after):
+    print("\n== Plan report (before -> after) ==")
+    for label, (after_lines, after_indexed) in after.items():
+        before_lines, before_indexed = before.get(label, (["(query not present before)"], False))
+        print(f"{'✅' if after_indexed else '⚠️'} {label}")
+        for line in before_lines:
+            print(f"    before: {line}")
+        for line in after_lines:
+            print(f"    after:  {line}")
+    remaining = [label for label, (_, indexed) in after.items() if not indexed]
+    if remaining:
+        # Tiny tables may still be scanned; the optimizer switches to the index as they grow
+        print(f"\n⚠️ Full scans remaining: {', '.join(remaining)}")
+    return not remaining
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else "status"
+    with pooled_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            if command == "status":
+                done = applied_versions(cursor)
+                for version, name, _ in MIGRATIONS:
+                    print(f"{'applied' if version in done else 'pending'}  {version:03d} {name}")
+                return 0
+            if command == "migrate":
+                applied = migrate(conn, cursor)
+                print(f"✅ Applied {len(applied)} migration(s)")
+                return 0
+            if command == "explain":
+                plans = explain_all(cursor)
+                print_plans(plans, "Hot query plans")
+                return 0 if all(indexed for _, indexed in plans.values()) else 1
+            if command == "report":
+                before = explain_all(cursor)
+                applied = migrate(conn, cursor)
+                print(f"✅ Applied {len(applied)} migration(s)")
+                after = explain_all(cursor)
+                return 0 if print_report(before, after) else 1
+        finally:
+            cursor.close()
+    print(f"Unknown command: {command} (use status, migrate, explain or report)")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,164 +1,197 @@
+import json
+import hashlib
 import mysql.connector
+import pandas as pd
+from classes.db_pool import pooled_connection
+from classes.batch_writer import BatchWriter, BatchWriteError, BatchFailure
+from classes.amenities_engine import update_missing_amenities
+from classes.export_cache import bump_export_versions
+from classes.run_registry import run_xids, xid_filter, uses_temp_xids, load_temp_xids, string_column
+from classes.data_point_mapping import SOURCE_TABLES, load_data_points_mapping
+from classes.norm_cache import instruction_hash
+from migrations import require_schema
 
-DB_CONFIG = {
-    "host": "localhost",
-    "user": "root",
-    "password": "",
-    "database": "audit_test"
-}
 PROJECT_KEY = "xid" 
 
-def update_matching_score(xids):
-    conn = mysql.connector.connect(**DB_CONFIG)
-    cursor = conn.cursor(dictionary=True)
+DEFAULT_BATCH_SIZE = 500
+PROGRESS_EVERY = 100  # Report progress(done, total) every N projects
+INSTRUCTIONS_PATH = "operation_prompts.json"
 
-    # Get all data points (columns) except id, website, created_at
-    cursor.execute("SHOW COLUMNS FROM data_points")
-    columns = [row['Field'] for row in cursor.fetchall() if row['Field'] not in ('id', 'website', 'created_at')]
-    print("Columns:", columns)
+# A row only goes back to pending (is_scored = 0, score = NULL) when its input hash changes.
+# MySQL applies the assignments left to right, so input_hash has to be the last one.
+AUDIT_UPSERT_QUERY = """
+    INSERT INTO competition_oprns_audit_data (
+        index_value, data_point_name, value_99acres, c1, c2, c3, input_hash
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        is_scored=IF(input_hash <=> VALUES(input_hash), is_scored, 0),
+        score=IF(input_hash <=> VALUES(input_hash), score, NULL),
+        value_99acres=VALUES(value_99acres),
+        c1=VALUES(c1),
+        c2=VALUES(c2),
+        c3=VALUES(c3),
+        input_hash=VALUES(input_hash)
+"""
 
-    cursor.execute("SELECT * FROM data_points")
-    data_points_rows = cursor.fetchall()
+AMENITIES_UPSERT_QUERY = '''
+    INSERT INTO competition_amenities (`Index`, `99acres`, `C1`, `C2`, `C3`)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        `99acres`=VALUES(`99acres`),
+        `C1`=VALUES(`C1`),
+        `C2`=VALUES(`C2`),
+        `C3`=VALUES(`C3`)
+'''
+
+def join_composite_values(values):
+    # Concatenate the non-empty parts of a composite mapping, None when all are empty
+    parts = [v for v in values if v]
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else " ".join(str(v) for v in parts)
+
+def load_instruction_versions(path=INSTRUCTIONS_PATH):
+    # {data_point: hash of its operation_prompts.json rule}; editing a rule re-queues its rows
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            instructions = json.load(f)
+    except FileNotFoundError:
+        print(f"⚠️ {path} not found, input hashes will not include instruction versions")
+        return {}
+    return {dp: instruction_hash(rule) for dp, rule in instructions.items()}
+
+def input_hash(instruction_version, *values):
+    # Hash of the raw ref/c1/c2/c3 values plus the instruction version of the data point
+    payload = json.dumps([instruction_version, *(None if v is None else str(v) for v in values)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def fetch_source_rows(cursor, table, columns, xids, run_id=None, temp_loaded=False):
+    # Load every mapped column for every requested XID from one source table in a single query.
+    # Large XID sets are joined (run registry or temporary table) rather than sent as an IN list.
+    if not columns or not xids:
+        return {}
+    select_cols = ", ".join(f"t.`{col}`" for col in sorted(columns))
+    # VARCHAR/TEXT xid columns are compared as strings so their index is used
+    collation = string_column(cursor, table, PROJECT_KEY)
+    join, where, params = xid_filter(cursor, xids, f"t.`{PROJECT_KEY}`", run_id, temp_loaded, collation)
+    cursor.execute(f"SELECT t.`{PROJECT_KEY}`, {select_cols} FROM `{table}` t {join} WHERE {where}", params)
+    rows = {}
+    for row in cursor.fetchall():
+        # Keep the first row per XID, same as fetchone() in the per-value lookup.
+        # Keyed by str() so int XIDs from the upload match VARCHAR xid columns too.
+        rows.setdefault(str(row[PROJECT_KEY]), row)
+    print(f"  [BULK] {table}: {len(rows)} of {len(xids)} XIDs found")
+    return rows
+
+def update_matching_score(xids=None, bulk=True, batch_size=DEFAULT_BATCH_SIZE, progress=None, run_id=None):
+    # Either an explicit XID list or a run id from classes.run_registry
+    if run_id:
+        xids = run_xids(run_id)
+    # The pooled connection goes back to the pool even when a step below raises
+    with pooled_connection() as conn:
+        require_schema(conn)
+        cursor = conn.cursor(dictionary=True)
+        try:
+            failures = match_projects(conn, cursor, xids, bulk, batch_size, progress, run_id)
+        finally:
+            cursor.close()
+    if failures:
+        raise BatchWriteError(failures)
+    print(" Data mapping and insertion complete.")
+
+def match_projects(conn, cursor, xids, bulk, batch_size, progress, run_id):
+    # Upserts audit and amenity rows for every XID; returns the failed batches
+
+    # Compiled once per data_points checksum and shared with MySQLHandler
+    mapping = load_data_points_mapping(cursor)
+    print("Columns:", [dp.name for dp in mapping.data_points])
+    instruction_versions = load_instruction_versions()
 
     print(PROJECT_KEY)
     print("Fetched project IDs from uploaded CSV:")
     projects = xids
     print(projects)
-    for project_id in projects:
-        for data_point in columns:
-            # Get column names for each source from mapping table
-            col_99acres = data_points_rows[0][data_point]
-            col_magicbricks = data_points_rows[1][data_point]
-            col_housing = data_points_rows[2][data_point]
-            col_squareyards = data_points_rows[3][data_point]
-
-            # Debug: Print column mappings
-            print(f"Data Point: {data_point}")
-            print(f"  99acres column: {col_99acres}")
-            print(f"  magicbricks column: {col_magicbricks}")
-            print(f"  housing column: {col_housing}")
-            print(f"  squareyards column: {col_squareyards}")
-
-            # Fetch values from each table
-            def get_value(table, col, pid):
-                if not col:
-                    print(f"  [SKIP] No column mapping for {table} on data point.")
-                    return None
-                print(f"  [QUERY] SELECT `{col}` FROM `{table}` WHERE `{PROJECT_KEY}` = {pid}")
-                cursor.execute(f"SELECT `{col}` FROM `{table}` WHERE `{PROJECT_KEY}` = %s", (pid,))
-                res = cursor.fetchone()
-                print(f"  [RESULT] {{res}}")
-                return res[col] if res and col in res else None
-
-            if(col_99acres=='Project Locality + Project Region'):
-                # Access 'Project Locality' and 'Project Region' columns for 99acres, concatenate them
-                col_locality = "Project_Locality"
-                col_region = "Project_Region"
-                val_locality = get_value("99acres_table", col_locality, project_id)
-                val_region = get_value("99acres_table", col_region, project_id)
-                v_99acres = ""
-                if val_locality and val_region:
-                    v_99acres = f"{val_locality} {val_region}"
-                elif val_locality:
-                    v_99acres = val_locality
-                elif val_region:
-                    v_99acres = val_region
+
+    # Large ad-hoc XID lists are loaded into a temporary table once and joined by every query below
+    temp_loaded = bool(projects) and uses_temp_xids(projects, run_id)
+    if temp_loaded:
+        load_temp_xids(cursor, projects)
+
+    # Bulk mode: one query per source table for all mapped columns and all XIDs
+    source_rows = {}
+    if bulk:
+        for table in SOURCE_TABLES:
+            source_rows[table] = fetch_source_rows(cursor, table, mapping.columns_for(table), projects, run_id, temp_loaded)
+
+    # Fetch values from each table
+    def get_value(table, col, pid):
+        if not col:
+            if not bulk:
+                print(f"  [SKIP] No column mapping for {table} on data point.")
+            return None
+        if bulk:
+            res = source_rows[table].get(str(pid))
+            return res.get(col) if res else None
+        print(f"  [QUERY] SELECT `{col}` FROM `{table}` WHERE `{PROJECT_KEY}` = {pid}")
+        cursor.execute(f"SELECT `{col}` FROM `{table}` WHERE `{PROJECT_KEY}` = %s", (pid,))
+        res = cursor.fetchone()
+        print(f"  [RESULT] {{res}}")
+        return res[col] if res and col in res else None
+
+    def get_mapped_value(source, pid):
+        # Composite mappings like 'Project Locality + Project Region' concatenate their parts
+        if source.is_composite:
+            return join_composite_values([get_value(source.table, col, pid) for col in source.columns])
+        return get_value(source.table, source.mapping, pid)
+
+    # Rows are buffered and upserted with executemany, one commit per batch. Leaving the block
+    # writes whatever is still buffered; on an error the buffered rows are dropped instead.
+    with BatchWriter(conn, AUDIT_UPSERT_QUERY, batch_size, label="competition_oprns_audit_data") as audit_writer, \
+            BatchWriter(conn, AMENITIES_UPSERT_QUERY, batch_size, label="competition_amenities") as amenities_writer:
+        for done, project_id in enumerate(projects, start=1):
+            if progress and (done % PROGRESS_EVERY == 0 or done == len(projects)):
+                progress(done, len(projects))
+            for dp in mapping.data_points:
+                data_point = dp.name
+                # Source columns come in mapping order: 99acres, magicbricks, housing, squareyards
+                v_99acres, v_magicbricks, v_housing, v_squareyards = (
+                    get_mapped_value(source, project_id) for source in dp.sources
+                )
+
+                if not bulk:
+                    # Debug: Print final values before insert
+                    print(f"Inserting for project {project_id}, data_point {data_point}:")
+                    print(f"  v_99acres: {v_99acres}")
+                    print(f"  v_magicbricks: {v_magicbricks}")
+                    print(f"  v_housing: {v_housing}")
+                    print(f"  v_squareyards: {v_squareyards}")
+
+                if data_point.lower() == 'amenities_list':
+                    # Insert or update amenities row only for input XIDs
+                    amenities_writer.add((project_id, v_99acres, v_magicbricks, v_housing, v_squareyards))
                 else:
-                    v_99acres = None
-            else:
-                v_99acres = get_value("99acres_table", col_99acres, project_id)
-
-            v_magicbricks = get_value("magic_bricks_table", col_magicbricks, project_id)
-            v_housing = get_value("housing_table", col_housing, project_id)
-            v_squareyards = get_value("square_yards_table", col_squareyards, project_id)
-
-            # Debug: Print final values before insert
-            print(f"Inserting for project {project_id}, data_point {data_point}:")
-            print(f"  v_99acres: {v_99acres}")
-            print(f"  v_magicbricks: {v_magicbricks}")
-            print(f"  v_housing: {v_housing}")
-            print(f"  v_squareyards: {v_squareyards}")
-
-            if data_point.lower() == 'amenities_list':
-                # Create amenities table if not exists
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS competition_amenities (
-                        `Index` INT PRIMARY KEY,
-                        `99acres` TEXT,
-                        `C1` TEXT,
-                        `C2` TEXT,
-                        `C3` TEXT,
-                        `missing_amenities` TEXT
-                    )
-                ''')
-                # Insert or update amenities row only for input XIDs
-                if project_id in projects:
-                    insert_query = '''
-                        INSERT INTO competition_amenities (`Index`, `99acres`, `C1`, `C2`, `C3`)
-                        VALUES (%s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE
-                            `99acres`=VALUES(`99acres`),
-                            `C1`=VALUES(`C1`),
-                            `C2`=VALUES(`C2`),
-                            `C3`=VALUES(`C3`)
-                    '''
-                    cursor.execute(insert_query, (project_id, v_99acres, v_magicbricks, v_housing, v_squareyards))
-                    conn.commit()
-            else:
-                # Insert or update in competition_oprns_audit_data
-                insert_query = """
-                    INSERT INTO competition_oprns_audit_data (
-                        index_value, data_point_name, value_99acres, c1, c2, c3
-                    ) VALUES (%s, %s, %s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE
-                        value_99acres=VALUES(value_99acres),
-                        c1=VALUES(c1),
-                        c2=VALUES(c2),
-                        c3=VALUES(c3)
-                """
-                cursor.execute(insert_query, (project_id, data_point, v_99acres, v_magicbricks, v_housing, v_squareyards))
-                conn.commit()
-
-    # Process amenities for only the given XIDs
-    import pandas as pd, re
-    def extract_amenities_99acres(amenities_str):
-        if pd.isna(amenities_str):
-            return []
-        items = re.split(r',\s*', amenities_str)
-        return list(set([re.sub(r'^\d+:\s*', '', item).strip().lower() for item in items]))
-    def extract_amenities_other(text):
-        if pd.isna(text):
-            return []
-        items = re.split(r',|;|/|&', text)
-        return list(set([item.strip().lower() for item in items if item.strip()]))
-    # Fetch amenities for these XIDs
+                    # Insert or update in competition_oprns_audit_data
+                    row_hash = input_hash(instruction_versions.get(data_point, ""),
+                                          v_99acres, v_magicbricks, v_housing, v_squareyards)
+                    audit_writer.add((project_id, data_point, v_99acres, v_magicbricks, v_housing, v_squareyards, row_hash))
+
+    failures = audit_writer.failures + amenities_writer.failures
+
+    # Missing amenities for only the given XIDs, diffed as bitsets and written in one UPDATE
     if projects:
-        cursor.execute(f"SELECT * FROM competition_amenities WHERE `Index` IN ({','.join(['%s']*len(projects))})", tuple(projects))
+        join, where, params = xid_filter(cursor, projects, "a.`Index`", run_id, temp_loaded)
+        cursor.execute(f"SELECT a.* FROM competition_amenities a {join} WHERE {where}", params)
         amenities_rows = cursor.fetchall()
         if amenities_rows:
-            df = pd.DataFrame(amenities_rows)
-            df['99acres_clean'] = df['99acres'].apply(extract_amenities_99acres)
-            df['C1_clean'] = df['C1'].apply(extract_amenities_other)
-            df['C2_clean'] = df['C2'].apply(extract_amenities_other)
-            df['C3_clean'] = df['C3'].apply(extract_amenities_other)
-            df['combined_C'] = df.apply(lambda row: list(set(row['C1_clean'] + row['C2_clean'] + row['C3_clean'])), axis=1)
-            df['missing_amenities'] = df.apply(
-                lambda row: sorted(set(map(str.lower, row['99acres_clean'])) - set(map(str.lower, row['combined_C']))),
-                axis=1
-            )
-            for idx, row in df.iterrows():
-                cell_value = ', '.join(row['missing_amenities'])
-                update_query = '''
-                    UPDATE competition_amenities
-                    SET missing_amenities = %s
-                    WHERE `Index` = %s
-                '''
-                cursor.execute(update_query, (cell_value, row["Index"]))
-            conn.commit()
+            try:
+                update_missing_amenities(conn, pd.DataFrame(amenities_rows))
+            except mysql.connector.Error as err:
+                print(f"❌ missing_amenities update failed ({len(amenities_rows)} rows): {err}")
+                failures.append(BatchFailure("missing_amenities", 1, len(amenities_rows), err))
 
-    print(" Data mapping and insertion complete.")
-    cursor.close()
-    conn.close()
+    # Cached exports of these tables are stale now
+    bump_export_versions(conn, ["competition_oprns_audit_data", "competition_amenities"])
+    return failures
 
 # Update main guard for new signature
 if __name__ == "__main__":